@@ -3,7 +3,32 @@ import pandas as pd
 import plotly.express as px
 from io import BytesIO
 import numpy as np
+import hashlib
+import os
+import re
+import shutil
+import multiprocessing
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
 from datetime import datetime
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import zipfile
+from exportacao import build_dossiers, to_csv_bytes, to_excel, to_parquet_bytes
+from ingestao import detect_format, list_sheets, parse_sheets, read_header, xlsx_engine
+from normalizacao import normalize_nusp
+from pareceres import LexiconError, classify_parecer, compile_lexicon, fold_text
+
+try:
+    import zstandard  # noqa: F401  (opcional, usado pelo pandas para o CSV compactado com zstd)
+    HAS_ZSTANDARD = True
+except ImportError:
+    HAS_ZSTANDARD = False
 
 # --- Configuração da Página ---
 st.set_page_config(
@@ -50,20 +75,428 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+# --- Colunas esperadas nos arquivos ---
+REQUIRED_COLS_CONSOLIDADO = ['nusp', 'disciplina', 'Ano', 'Semestre', 'problema', 'parecer']
+# **ALTERAÇÃO**: Agora a coluna 'problema' também é obrigatória no arquivo de requerimentos
+REQUIRED_COLS_REQUERIMENTOS = ['nusp', 'Nome completo', 'problema']
+# Sinônimos aceitos para cada coluna padrão, em ordem de preferência. A comparação ignora acentos,
+# maiúsculas e pontuação ("Número USP", "N° USP" e "numero_usp" são equivalentes).
+COLUMN_SYNONYMS = {
+    'nusp': ['nusp', 'numero usp', 'n usp', 'no usp', 'numero de matricula usp', 'numero usp do aluno'],
+    'disciplina': ['disciplina', 'codigo da disciplina', 'cod disciplina', 'sigla da disciplina'],
+    'Ano': ['ano', 'ano letivo'],
+    'Semestre': ['semestre', 'sem', 'periodo letivo'],
+    'problema': ['problema', 'tipo de problema', 'motivo'],
+    'parecer': ['parecer', 'resultado', 'decisao', 'situacao'],
+    'Nome completo': ['nome completo', 'nome do aluno', 'nome', 'aluno'],
+}
+# Trechos que identificam a coluna de NUSP quando nenhum sinônimo bate exatamente (ex.: "NUSP do aluno").
+NUSP_KEYWORDS = ['nusp', 'numero usp', 'n usp']
+
+# --- Cache de leitura de arquivos ---
+# Número máximo de arquivos já lidos mantidos em memória (compartilhado entre sessões).
+PARSE_CACHE_MAX_ENTRIES = 8
+
+class LRUCache:
+    """Cache LRU limitado por número de entradas (e, opcionalmente, por bytes), seguro para as várias sessões (threads) do servidor."""
+    def __init__(self, max_entries, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value, size=0):
+        """Guarda `value`; `size` (em bytes) só conta para caches com `max_bytes`. Itens maiores que o limite não são guardados."""
+        with self._lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self.bytes += size - self._sizes.get(key, 0)
+            self._data[key] = value
+            self._sizes[key] = size
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                antiga, _ = self._data.popitem(last=False)
+                self.bytes -= self._sizes.pop(antiga)
+
+    def __contains__(self, key):
+        """Se `key` está guardada, sem contar acerto ou falha nem mudar a ordem de uso."""
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+@st.cache_resource
+def get_parse_cache():
+    """DataFrames já lidos, indexados pelo SHA-256 do conteúdo do arquivo enviado."""
+    return LRUCache(PARSE_CACHE_MAX_ENTRIES)
+
+# --- Resolução das colunas ---
+SCHEMA_CACHE_MAX_ENTRIES = 64
+
+class ColumnMappingRequired(Exception):
+    """Colunas obrigatórias não reconhecidas automaticamente em um arquivo (ou aba)."""
+    def __init__(self, file_name, sheet, header, required_cols, mapping, missing):
+        super().__init__(f"Arquivo '{file_name}': colunas não reconhecidas - {', '.join(missing)}")
+        self.file_name, self.sheet, self.header = file_name, sheet, header
+        self.required_cols, self.mapping, self.missing = required_cols, mapping, missing
+
+@st.cache_resource
+def get_schema_cache():
+    """Mapeamentos de colunas resolvidos automaticamente, pela assinatura do cabeçalho (compartilhado entre sessões)."""
+    return LRUCache(SCHEMA_CACHE_MAX_ENTRIES)
+
+def manual_mappings():
+    """Mapeamentos indicados à mão nesta sessão, pela assinatura do cabeçalho.
+
+    Ficam na sessão, e não no cache compartilhado, para que uma escolha errada não afete os outros usuários.
+    """
+    return st.session_state.setdefault("mapeamentos_manuais", {})
+
+def manual_mappings_fingerprint():
+    return hashlib.sha256(repr(sorted(manual_mappings().items(), key=repr)).encode()).hexdigest()
+
+def normalize_header(name):
+    """Nome de coluna sem acentos, em minúsculas e só com letras/dígitos separados por espaço."""
+    texto = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode("ascii").lower()
+    return " ".join(re.findall(r"[a-z0-9]+", texto))
+
+def header_signature(header, required_cols):
+    return (tuple(map(str, header)), tuple(required_cols))
+
+def _resolve_columns(header, required_cols):
+    synonyms = {}
+    for canonical in required_cols:
+        for rank, synonym in enumerate([canonical] + COLUMN_SYNONYMS.get(canonical, [])):
+            synonyms.setdefault(normalize_header(synonym), (canonical, rank))
+
+    best, nusp_by_keyword = {}, None
+    for col in header:
+        key = normalize_header(col)
+        if key in synonyms:
+            canonical, rank = synonyms[key]
+            if canonical not in best or rank < best[canonical][0]:
+                best[canonical] = (rank, col)
+        elif nusp_by_keyword is None and any(keyword in key for keyword in NUSP_KEYWORDS):
+            nusp_by_keyword = col
+    if 'nusp' in required_cols and 'nusp' not in best and nusp_by_keyword is not None:
+        best['nusp'] = (None, nusp_by_keyword)
+
+    mapping = {col: canonical for canonical, (_, col) in best.items()}
+    return mapping, [c for c in required_cols if c not in best]
+
+def resolve_columns(header, required_cols):
+    """Mapeia, numa única passada, as colunas do cabeçalho para os nomes padrão em `required_cols`.
+
+    Retorna ({coluna original: nome padrão}, colunas padrão não encontradas). Um mapeamento manual
+    desta sessão tem prioridade; o automático fica em cache pela assinatura do cabeçalho: o mesmo
+    formato de exportação é resolvido uma vez só.
+    """
+    key = header_signature(header, required_cols)
+    manual = manual_mappings().get(key)
+    if manual is not None:
+        return manual
+    cache = get_schema_cache()
+    resolved = cache.get(key)
+    if resolved is None:
+        resolved = _resolve_columns(header, required_cols)
+        cache.put(key, resolved)
+    return resolved
+
+def manual_mapping_form(pendencia):
+    """Pede ao usuário a coluna de cada nome padrão não reconhecido e guarda o mapeamento desta sessão para este formato."""
+    aba = f" (aba {pendencia.sheet})" if isinstance(pendencia.sheet, str) else ""
+    st.warning(f"⚠️ Não foi possível identificar as colunas {', '.join(pendencia.missing)} no arquivo '{pendencia.file_name}'{aba}. Indique abaixo a coluna correspondente a cada uma.")
+    key = header_signature(pendencia.header, pendencia.required_cols)
+    livres = [i for i, col in enumerate(pendencia.header) if col not in pendencia.mapping]
+    with st.form(f"mapeamento_{hashlib.sha256(repr(key).encode()).hexdigest()[:12]}"):
+        escolhas = {canonical: st.selectbox(f"Coluna para **{canonical}**", livres, format_func=lambda i: str(pendencia.header[i]))
+                    for canonical in pendencia.missing}
+        if st.form_submit_button("Confirmar mapeamento"):
+            if len(set(escolhas.values())) < len(escolhas):
+                st.error("Cada coluna do arquivo só pode ser usada uma vez.")
+            else:
+                mapping = {**pendencia.mapping, **{pendencia.header[i]: canonical for canonical, i in escolhas.items()}}
+                manual_mappings()[key] = (mapping, [])
+                st.rerun()
+
 # --- Função para carregar arquivos de forma robusta ---
-def load_data(uploaded_file):
-    """Tenta ler um arquivo como Excel e, se falhar, tenta como CSV."""
-    try:
-        df = pd.read_excel(uploaded_file)
-        return df
-    except Exception:
+# Número máximo de processos usados para ler vários arquivos ao mesmo tempo.
+PARSE_MAX_WORKERS = os.cpu_count() or 1
+
+def describe_format(info):
+    """Texto curto do caminho de leitura usado, para o painel de debug."""
+    if info["formato"] == "csv":
+        return f"CSV (separador {info['sep']!r}, codificação {info['encoding']})"
+    if info["formato"] == "parquet":
+        return "histórico armazenado no servidor (Parquet)"
+    return f"Excel ({info['formato']}, leitor {info['leitor']})" if "leitor" in info else f"Excel ({info['formato']})"
+
+def plan_file(data, file_name, required_cols, all_sheets):
+    """Detecta o formato e decide o que ler de cada aba: lista de (info, usecols, aba).
+
+    Levanta ColumnMappingRequired se alguma coluna obrigatória não for reconhecida.
+    """
+    info = detect_format(data, file_name)
+    if info["formato"] == "xlsx":
+        info["leitor"] = xlsx_engine()
+    sheets = list_sheets(data, info) if all_sheets else [0]
+    partes, sem_nusp = [], None
+    for sheet in sheets:
+        header = read_header(data, info, sheet)
+        mapping, missing = resolve_columns(header, required_cols)
+        if 'nusp' in missing:
+            # Abas sem coluna de NUSP (resumos, gráficos...) são ignoradas.
+            sem_nusp = sem_nusp or ColumnMappingRequired(file_name, sheet, header, required_cols, mapping, missing)
+            continue
+        if missing:
+            raise ColumnMappingRequired(file_name, sheet, header, required_cols, mapping, missing)
+        usecols = [i for i, col in enumerate(header) if col in mapping]
+        partes.append(({**info, "arquivo": file_name, "aba": sheet, "colunas": f"{len(usecols)} de {len(header)}", "mapeamento": mapping}, usecols, sheet))
+    if not partes:
+        raise sem_nusp
+    return partes
+
+def process_pool(max_workers):
+    """Pool de processos iniciado por 'forkserver' (ou 'spawn', onde não houver).
+
+    Um 'fork' direto deste processo, que tem as threads do servidor do Streamlit, pode travar em
+    locks mantidos por elas; as funções enviadas ao pool ficam em módulos importáveis.
+    """
+    metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(metodo))
+
+def parse_parts(tarefas):
+    """Lê os arquivos pendentes, cada um uma tarefa (data, [(info, usecols, aba), ...]) enviada uma única vez.
+
+    Com mais de um arquivo, a leitura é feita em paralelo num pool de processos (a leitura do .xlsx é
+    limitada pela CPU). Retorna, para cada arquivo, a lista com o DataFrame lido ou a exceção de cada aba.
+    """
+    if len(tarefas) <= 1 or PARSE_MAX_WORKERS <= 1:
+        resultados = []
+        for tarefa in tarefas:
+            progresso = st.progress(0.0, text=f"Lendo {tarefa[1][0][0]['arquivo']}...")
+            def mostrar_progresso(info, lidas, total):
+                aba = f" (aba {info['aba']})" if isinstance(info.get("aba"), str) else ""
+                progresso.progress(lidas / total if total else 1.0, text=f"Lendo {info['arquivo']}{aba}: {lidas:,} de ~{total:,} linhas".replace(",", "."))
+            resultados.append(parse_sheets(tarefa, progress=mostrar_progresso))
+            progresso.empty()
+        return resultados
+
+    resultados = [None] * len(tarefas)
+    progresso = st.progress(0.0, text=f"Lendo arquivos: 0/{len(tarefas)}")
+    with process_pool(min(len(tarefas), PARSE_MAX_WORKERS)) as pool:
+        futuros = {pool.submit(parse_sheets, tarefa): i for i, tarefa in enumerate(tarefas)}
+        for n, futuro in enumerate(as_completed(futuros), 1):
+            i = futuros[futuro]
+            erro = futuro.exception()
+            resultados[i] = [erro] * len(tarefas[i][1]) if erro else futuro.result()
+            progresso.progress(n / len(tarefas), text=f"Lendo arquivos: {n}/{len(tarefas)}")
+    progresso.empty()
+    return resultados
+
+def load_data(uploaded_files, required_cols, all_sheets=False):
+    """Lê dos arquivos enviados apenas as colunas necessárias e junta tudo num único DataFrame.
+
+    Para cada arquivo (e, com `all_sheets`, cada aba com coluna de NUSP) a leitura é feita em
+    duas fases: primeiro só o cabeçalho, para localizar as colunas usadas (`resolve_columns`),
+    depois o conteúdo com `usecols`. As partes que não estão no cache são lidas em paralelo,
+    renomeadas para os nomes padrão e concatenadas. Se alguma coluna não for reconhecida, mostra
+    o formulário de mapeamento manual e interrompe a execução.
+    Retorna o DataFrame e a lista de informações de leitura de cada parte (ou None, None em caso de falha).
+    """
+    cache = get_parse_cache()
+    partes_lidas, pendentes = [], []
+    for uploaded_file in uploaded_files:
+        data = uploaded_file.getvalue()
+        # Os mapeamentos manuais da sessão entram na chave: o DataFrame guardado já vem com as colunas renomeadas.
+        cache_key = (hashlib.sha256(data).hexdigest(), tuple(required_cols), all_sheets, manual_mappings_fingerprint())
+        cached = cache.get(cache_key)
+        if cached is not None:
+            partes_lidas.extend((df, {**info, "cache": True}) for df, info in cached)
+            continue
         try:
-            uploaded_file.seek(0)
-            df = pd.read_csv(uploaded_file)
-            return df
+            plano = plan_file(data, uploaded_file.name, required_cols, all_sheets)
+        except ColumnMappingRequired as pendencia:
+            manual_mapping_form(pendencia)
+            return None, None
         except Exception:
             st.error(f"Falha ao ler o arquivo '{uploaded_file.name}'. Verifique se o formato é Excel (.xlsx) ou CSV (.csv).")
-            return None
+            return None, None
+        pendentes.append((cache_key, data, plano))
+
+    resultados = parse_parts([(data, plano) for _, data, plano in pendentes])
+    for (cache_key, _, plano), lidos in zip(pendentes, resultados):
+        partes = []
+        for (info, _, _), df in zip(plano, lidos):
+            if isinstance(df, Exception):
+                st.error(f"Falha ao ler o arquivo '{info['arquivo']}'. Verifique se o formato é Excel (.xlsx) ou CSV (.csv).")
+                return None, None
+            # Cada arquivo/aba pode nomear as colunas de um jeito: padroniza antes de juntar.
+            df.rename(columns=info["mapeamento"], inplace=True)
+            partes.append((df, info))
+        cache.put(cache_key, partes)
+        partes_lidas.extend((df, {**info, "cache": False}) for df, info in partes)
+
+    # Devolve uma cópia: o processamento altera os DataFrames no lugar (rename/dropna).
+    if len(partes_lidas) == 1:
+        df = partes_lidas[0][0].copy()
+    else:
+        df = pd.concat([df for df, _ in partes_lidas], ignore_index=True)
+    return df, [info for _, info in partes_lidas]
+
+# --- Histórico armazenado no servidor ---
+# O consolidado muda só uma vez por semestre: fica gravado em Parquet, um diretório por semestre
+# (ex.: dados/historico/2024_1/part-*.parquet), e é lido direto nas sessões seguintes.
+HISTORY_STORE_DIR = os.environ.get("HISTORICO_DIR", os.path.join("dados", "historico"))
+HISTORY_KEY_COLS = ['nusp', 'disciplina', 'Ano', 'Semestre']
+# Esquema fixo: todas as partições precisam ter os mesmos tipos para serem lidas juntas.
+HISTORY_SCHEMA = pa.schema([("nusp", pa.int64())] + [(col, pa.string()) for col in REQUIRED_COLS_CONSOLIDADO if col != "nusp"])
+
+def _store_files():
+    """Arquivos Parquet do histórico, ignorando temporários (iniciados por '.')."""
+    files = []
+    for root, _, names in os.walk(HISTORY_STORE_DIR):
+        files.extend(os.path.join(root, name) for name in names if name.endswith(".parquet") and not name.startswith("."))
+    return sorted(files)
+
+STORE_INFO_CACHE_MAX_ENTRIES = 4
+
+@st.cache_resource
+def get_store_info_cache():
+    """Resumos do histórico armazenado (`history_store_info`), pela assinatura dos diretórios."""
+    return LRUCache(STORE_INFO_CACHE_MAX_ENTRIES)
+
+def _store_dirs_signature():
+    """Inode e mtime do diretório do histórico e de cada partição, ou None se ele não existir.
+
+    Criar ou remover um arquivo muda o mtime do diretório que o contém: basta listar o primeiro nível,
+    sem abrir os arquivos Parquet.
+    """
+    try:
+        raiz = os.stat(HISTORY_STORE_DIR)
+        with os.scandir(HISTORY_STORE_DIR) as entradas:
+            particoes = tuple(sorted((e.name, e.stat().st_mtime_ns) for e in entradas if e.is_dir()))
+    except FileNotFoundError:
+        return None
+    return (HISTORY_STORE_DIR, raiz.st_ino, raiz.st_mtime_ns, particoes)
+
+def history_store_info():
+    """Registros, semestres e data da última gravação do histórico armazenado, ou None se ainda não existir.
+
+    O resumo fica em cache enquanto os diretórios não mudarem: reexecuções da página não percorrem o histórico.
+    """
+    assinatura = _store_dirs_signature()
+    if assinatura is None:
+        return None
+    cache = get_store_info_cache()
+    guardado = cache.get(assinatura)
+    if guardado is None:
+        # Guardado numa tupla: o resumo pode ser None (diretório sem arquivos).
+        guardado = (_read_store_info(),)
+        cache.put(assinatura, guardado)
+    return guardado[0]
+
+def _read_store_info():
+    files = _store_files()
+    if not files:
+        return None
+    stats = [os.stat(f) for f in files]
+    return {
+        "registros": sum(pq.ParquetFile(f).metadata.num_rows for f in files),
+        "semestres": len({os.path.dirname(f) for f in files}),
+        "atualizado_em": datetime.fromtimestamp(max(st_.st_mtime for st_ in stats)),
+        "assinatura": tuple((f, st_.st_size, st_.st_mtime_ns) for f, st_ in zip(files, stats)),
+    }
+
+def _normalize_for_store(df_consolidado):
+    """Converte o histórico para o esquema do armazenamento: NUSP inteiro e demais colunas como texto."""
+    df = df_consolidado[REQUIRED_COLS_CONSOLIDADO].copy()
+    df["nusp"] = df["nusp"].astype("int64")
+    for col in df.columns.drop("nusp"):
+        texto = df[col].astype(str).str.strip()
+        if col in ("Ano", "Semestre"):
+            # 2024 e 2024.0 (Excel com células vazias) devem virar a mesma chave "2024".
+            numero = pd.to_numeric(df[col], errors="coerce")
+            inteiro = numero.notna() & (numero % 1 == 0)
+            texto[inteiro] = numero[inteiro].astype("int64").astype(str)
+        df[col] = texto.mask(df[col].isna())
+    return df
+
+def _partition_dir(ano, semestre):
+    nome = "_".join("sem_valor" if pd.isna(v) else re.sub(r"[^\w-]", "-", str(v)) for v in (ano, semestre))
+    return os.path.join(HISTORY_STORE_DIR, nome)
+
+def _write_part(df, part_dir):
+    """Grava um novo arquivo na partição, de forma atômica (temporário + rename)."""
+    os.makedirs(part_dir, exist_ok=True)
+    name = f"part-{datetime.now():%Y%m%d%H%M%S%f}.parquet"
+    tmp_path = os.path.join(part_dir, f".{name}.tmp")
+    pq.write_table(pa.Table.from_pandas(df, schema=HISTORY_SCHEMA, preserve_index=False), tmp_path)
+    os.replace(tmp_path, os.path.join(part_dir, name))
+
+def save_history_store(df_consolidado):
+    """Substitui todo o histórico armazenado pelo consolidado informado (já normalizado, NUSP inteiro)."""
+    df = _normalize_for_store(df_consolidado)
+    if df.empty:
+        raise ValueError("O histórico não tem registros válidos: o histórico armazenado não foi alterado.")
+    tmp_dir, old_dir = f"{HISTORY_STORE_DIR}.tmp", f"{HISTORY_STORE_DIR}.old"
+    # Sobras de uma gravação interrompida impediriam os os.replace abaixo.
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    for (ano, semestre), grupo in df.groupby(["Ano", "Semestre"], dropna=False, sort=False):
+        _write_part(grupo, _partition_dir(ano, semestre).replace(HISTORY_STORE_DIR, tmp_dir, 1))
+    if os.path.exists(HISTORY_STORE_DIR):
+        os.replace(HISTORY_STORE_DIR, old_dir)
+    os.replace(tmp_dir, HISTORY_STORE_DIR)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def append_semester(df_novos):
+    """Acrescenta ao histórico apenas as linhas cujas chaves (nusp, disciplina, Ano, Semestre) ainda não existem.
+
+    Só as partições dos semestres presentes em `df_novos` são consultadas, então o custo depende
+    do tamanho do semestre novo e não do histórico inteiro. Retorna (linhas gravadas, linhas ignoradas).
+    """
+    df = _normalize_for_store(df_novos)
+    gravadas = 0
+    for (ano, semestre), grupo in df.groupby(["Ano", "Semestre"], dropna=False, sort=False):
+        grupo = grupo.drop_duplicates(subset=HISTORY_KEY_COLS)
+        part_dir = _partition_dir(ano, semestre)
+        existentes = [f for f in _store_files() if os.path.dirname(f) == part_dir]
+        if existentes:
+            chaves = ds.dataset(existentes, schema=HISTORY_SCHEMA, format="parquet").to_table(columns=HISTORY_KEY_COLS).to_pandas()
+            ja_gravadas = pd.MultiIndex.from_frame(grupo[HISTORY_KEY_COLS].fillna("")).isin(pd.MultiIndex.from_frame(chaves.fillna("")))
+            grupo = grupo[~ja_gravadas]
+        if not grupo.empty:
+            _write_part(grupo, part_dir)
+            gravadas += len(grupo)
+    return gravadas, len(df) - gravadas
+
+def load_history_store(store_info):
+    """Lê o histórico armazenado (leitura colunar com memory map), com o mesmo retorno de `load_data`."""
+    cache_key = ("historico", HISTORY_STORE_DIR, store_info["assinatura"])
+    cache = get_parse_cache()
+    cached = cache.get(cache_key)
+    if cached is None:
+        df = pq.read_table(HISTORY_STORE_DIR, schema=HISTORY_SCHEMA, partitioning=None, memory_map=True).to_pandas()
+        info = {"formato": "parquet", "arquivo": HISTORY_STORE_DIR, "colunas": f"{df.shape[1]} de {df.shape[1]}"}
+        cache.put(cache_key, (df, info))
+    else:
+        df, info = cached
+    return df.copy(), [{**info, "cache": cached is not None}]
 
 # --- Funções Auxiliares ---
 def format_problem_type(problem):
@@ -74,80 +507,585 @@ def format_problem_type(problem):
     elif problem == "CH": return "🟡 Conflito de Horário"
     return f"⚪ {problem}"
 
-def format_parecer(parecer):
-    """Formata o parecer para exibição com ícones, com lógica corrigida."""
-    if pd.isna(parecer):
-        return "📝 Pendente"
-    parecer_str = str(parecer).lower()
-    # **CORREÇÃO**: Primeiro checa por termos negativos.
-    if "negado" in parecer_str or "indeferido" in parecer_str:
-        return f"❌ {parecer}"
-    # Somente se não for negativo, checa por termos positivos.
-    elif "aprovado" in parecer_str:
-        return f"✅ {parecer}"
-    # Caso contrário, trata como pendente/neutro.
-    return f"📝 {parecer}"
-
-@st.cache_data
-def to_excel(df):
+STATUS_ICONS = {'aprovado': '✅', 'negado': '❌', 'pendente': '📝', 'outro': '📝'}
+# Regras de classificação (ordenadas); os exemplos de pareceres reais que as conferem estão em tests/test_pareceres.py.
+LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lexico_pareceres.json")
+
+@st.cache_resource
+def load_lexicon(conteudo):
+    """Léxico compilado (`compile_lexicon`), uma vez por conteúdo do arquivo."""
+    return compile_lexicon(conteudo)
+
+def read_lexicon():
+    with open(LEXICON_PATH, encoding="utf-8") as f:
+        return f.read()
+
+def format_parecer_column(parecer, status):
+    """Parecer com o ícone do status, para exibição (vetorizado)."""
+    icones = status.map(STATUS_ICONS).astype(str)
+    return icones + ' ' + parecer.astype(object).where(parecer.notna(), 'Pendente').astype(str)
+
+# --- Exportação ---
+# Arquivos exportados mantidos em memória (compartilhados entre sessões), limitados em quantidade e em bytes.
+EXPORT_CACHE_MAX_ENTRIES = 16
+EXPORT_CACHE_MAX_BYTES = 256 * 1024 ** 2
+
+@st.cache_resource
+def get_export_cache():
+    """Arquivos exportados, indexados pela impressão digital do processamento e pelo formato."""
+    return LRUCache(EXPORT_CACHE_MAX_ENTRIES, max_bytes=EXPORT_CACHE_MAX_BYTES)
+
+def cached_export(impressao, formato, gerar):
+    """Bytes do arquivo exportado em `formato`, gerados por `gerar()` só na primeira vez para este resultado.
+
+    A chave é a impressão digital das entradas do processamento, e não o conteúdo do DataFrame:
+    reexecuções não precisam calcular o hash da tabela inteira.
+    """
+    cache = get_export_cache()
+    chave = (impressao, formato)
+    dados = cache.get(chave)
+    if dados is None:
+        dados = gerar()
+        cache.put(chave, dados, size=len(dados))
+    return dados
+
+# Formatos de exportação: rótulo -> (extensão, tipo MIME, função que gera os bytes a partir do DataFrame).
+EXPORT_FORMATS = {
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", to_excel),
+    "CSV": ("csv", "text/csv", to_csv_bytes),
+    "CSV compactado (gzip)": ("csv.gz", "application/gzip", lambda df: to_csv_bytes(df, 'gzip')),
+    "Parquet": ("parquet", "application/vnd.apache.parquet", to_parquet_bytes),
+}
+if HAS_ZSTANDARD:
+    EXPORT_FORMATS["CSV compactado (zstd)"] = ("csv.zst", "application/zstd", lambda df: to_csv_bytes(df, 'zstd'))
+
+def validate_columns(df, required_cols, nome):
+    missing = [col for col in required_cols if col not in df.columns]
+    if missing: raise ValueError(f"Arquivo {nome}: colunas faltando - {', '.join(missing)}")
+
+# Tipos compactos aplicados após a validação: categorias para colunas com poucos valores distintos
+# e inteiros pequenos para ano, semestre e NUSP.
+SCHEMA_CONSOLIDADO = {'nusp': 'uint32', 'disciplina': 'category', 'Ano': 'Int16', 'Semestre': 'UInt8', 'problema': 'category', 'parecer': 'category'}
+SCHEMA_REQUERIMENTOS = {'nusp': 'uint32', 'problema': 'category'}
+
+def apply_schema(df, schema):
+    """Converte as colunas para os tipos compactos do esquema (no lugar).
+
+    Colunas numéricas com valores não inteiros ou fora do intervalo do tipo viram categoria,
+    para não perder dados (ex.: Semestre escrito como "1º").
+    """
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if dtype != 'category':
+            numero = pd.to_numeric(df[col], errors='coerce')
+            limites = np.iinfo(getattr(pd.api.types.pandas_dtype(dtype), 'numpy_dtype', dtype))
+            validos = numero.dropna()
+            if numero.notna().sum() == df[col].notna().sum() and (validos % 1 == 0).all() and validos.between(limites.min, limites.max).all():
+                df[col] = numero.astype(dtype)
+                continue
+        df[col] = df[col].astype('category')
+    return df
+
+def memory_mb(*dfs):
+    return sum(df.memory_usage(deep=True).sum() for df in dfs) / 1024 ** 2
+
+def build_student_index(df):
+    """Ordena por NUSP uma única vez e devolve (df ordenado, {nusp: (início, fim)}).
+
+    Com o índice, o histórico de cada aluno é um recorte `iloc[início:fim]`, sem refiltrar o DataFrame inteiro.
+    """
+    df_sorted = df.sort_values('nusp', kind='stable').reset_index(drop=True)
+    nusps, inicios = np.unique(df_sorted['nusp'].to_numpy(), return_index=True)
+    fins = np.append(inicios[1:], len(df_sorted))
+    return df_sorted, dict(zip(nusps.tolist(), zip(inicios.tolist(), fins.tolist())))
+
+def build_result_tables(df_requerimentos, df_consolidado):
+    """Cruza requerimentos e histórico sem a explosão muitos-para-muitos do merge direto.
+
+    Os requerimentos atuais são agregados por NUSP (nome, problemas e quantidade de pedidos) e o
+    histórico é filtrado com `isin` para os alunos atuais antes do join. Retorna
+    (requerimentos_por_aluno, alunos_com_historico), este último com uma linha por pedido do histórico.
+    """
+    requerimentos_por_aluno = df_requerimentos.groupby('nusp', sort=False, observed=True).agg(**{
+        'Nome completo': ('Nome completo', 'first'),
+        'problema_atual': ('problema_atual', lambda s: ', '.join(s.dropna().astype(str).unique())),
+        'qtd_requerimentos': ('nusp', 'size'),
+    }).reset_index()
+    # Linhas repetidas no histórico (ex.: o mesmo semestre em dois arquivos) contariam o pedido duas vezes.
+    historico = df_consolidado[df_consolidado['nusp'].isin(requerimentos_por_aluno['nusp'])].drop_duplicates()
+    alunos_com_historico = requerimentos_por_aluno.merge(historico, on='nusp', how='inner')
+    return requerimentos_por_aluno, alunos_com_historico
+
+# --- Métricas ---
+@dataclass(frozen=True)
+class Metrics:
+    """Números exibidos nos cartões e gráficos, calculados de uma vez por `compute_metrics`."""
+    total_requerimentos: int
+    alunos_atuais: int
+    alunos_com_historico: int
+    total_qr: int
+    total_ch: int
+    taxa_aprovacao: float
+    media_pedidos_por_aluno: float
+    top_disciplinas: pd.Series
+    distribuicao_temporal: pd.Series
+
+    @property
+    def percentual_com_historico(self):
+        return self.alunos_com_historico / self.alunos_atuais * 100 if self.alunos_atuais > 0 else 0
+
+def period_column(df):
+    """Período "Ano/Semestre" como categoria, montado pelos códigos de ano e semestre em vez de concatenar texto linha a linha."""
+    codigos_ano, anos = pd.factorize(df['Ano_historico'], use_na_sentinel=False)
+    codigos_semestre, semestres = pd.factorize(df['Semestre_historico'], use_na_sentinel=False)
+    rotulos = [f"{ano}/{semestre}" for ano in anos.astype(str) for semestre in semestres.astype(str)]
+    periodo = pd.Categorical.from_codes(codigos_ano * len(semestres) + codigos_semestre, rotulos).remove_unused_categories()
+    return periodo.reorder_categories(sorted(periodo.categories))
+
+# --- Cubo de contagens ---
+# Dimensões do cubo e a coluna de `alunos_com_historico` de onde cada uma sai.
+CUBE_DIMENSIONS = {'disciplina': 'disciplina_historico', 'periodo': 'periodo', 'problema': 'problema_historico', 'status': 'status_historico'}
+
+@dataclass(frozen=True)
+class CountCube:
+    """Pedidos do histórico contados por disciplina × período × problema × status, num array NumPy denso.
+
+    Cada eixo tem uma posição a mais, no fim, para valores ausentes: eles entram nos totais, mas não
+    aparecem como categoria nos agrupamentos.
+    """
+    contagens: np.ndarray
+    categorias: dict
+
+    def count(self, by=(), **filtros):
+        """Total de pedidos agrupado pelas dimensões em `by` (no máximo duas) e restrito aos valores em `filtros`.
+
+        Retorna um inteiro sem `by`, uma Series com uma dimensão e um DataFrame (linhas × colunas) com duas.
+        Ex.: `cubo.count(by=['periodo'], problema='QR')` ou `cubo.count(by=['disciplina', 'status'])`.
+        """
+        if len(by) > 2:
+            raise ValueError("O cubo agrupa por no máximo duas dimensões.")
+        contagens, rotulos = self.contagens, {}
+        for eixo, (dim, categorias) in enumerate(self.categorias.items()):
+            if dim in filtros:
+                posicoes = categorias.get_indexer(np.atleast_1d(filtros[dim]))
+                posicoes = posicoes[posicoes >= 0]
+            elif dim in by:
+                posicoes = np.arange(len(categorias))
+            else:
+                continue
+            contagens = contagens.take(posicoes, axis=eixo)
+            rotulos[dim] = categorias[posicoes]
+        eixos = list(self.categorias)
+        contagens = contagens.sum(axis=tuple(i for i, dim in enumerate(eixos) if dim not in by))
+        if not by:
+            return int(contagens)
+        if len(by) == 1:
+            return pd.Series(contagens, index=rotulos[by[0]])
+        if eixos.index(by[0]) > eixos.index(by[1]):
+            contagens = contagens.T
+        return pd.DataFrame(contagens, index=rotulos[by[0]], columns=rotulos[by[1]])
+
+    @property
+    def nbytes(self):
+        return self.contagens.nbytes
+
+def build_count_cube(alunos_com_historico):
+    """Monta o cubo de contagens numa única passada: combina os códigos das quatro colunas categóricas
+    num índice plano (`np.ravel_multi_index`) e conta com `np.bincount`.
+
+    Espera a coluna 'periodo' (`period_column`). Problemas com a mesma grafia em maiúsculas ("qr" e "QR")
+    viram uma única categoria.
+    """
+    codigos, categorias = [], {}
+    for dim, coluna in CUBE_DIMENSIONS.items():
+        serie = alunos_com_historico[coluna]
+        if not isinstance(serie.dtype, pd.CategoricalDtype):
+            serie = serie.astype('category')
+        codigo, cats = serie.cat.codes.to_numpy(), serie.cat.categories
+        if dim == 'problema':
+            cats, recodificar = np.unique(cats.astype(str).str.upper(), return_inverse=True)
+            codigo = np.where(codigo >= 0, recodificar.ravel()[codigo], -1)
+            cats = pd.Index(cats)
+        # Código -1 (ausente) vai para a última posição do eixo.
+        codigos.append(np.where(codigo >= 0, codigo, len(cats)))
+        categorias[dim] = cats
+    forma = tuple(len(cats) + 1 for cats in categorias.values())
+    contagens = np.bincount(np.ravel_multi_index(codigos, forma), minlength=int(np.prod(forma))).reshape(forma)
+    return CountCube(contagens=contagens, categorias=categorias)
+
+def compute_metrics(df_requerimentos, requerimentos_por_aluno, alunos_com_historico, cubo):
+    """Calcula as métricas a partir do cubo de contagens, sem voltar às linhas do histórico.
+
+    Só o número de alunos distintos com histórico sai de `alunos_com_historico`; totais, taxa e
+    rankings são recortes de `cubo`.
+    """
+    pedidos_historico = cubo.count()
+    alunos_com_historico_n = len(pd.unique(alunos_com_historico['nusp'].to_numpy()))
+    por_problema = cubo.count(by=['problema'])
+    por_status = cubo.count(by=['status'])
+    com_parecer = por_status.get('aprovado', 0) + por_status.get('negado', 0)
+    por_disciplina = cubo.count(by=['disciplina'])
+    por_periodo = cubo.count(by=['periodo'])
+    return Metrics(
+        total_requerimentos=len(df_requerimentos),
+        alunos_atuais=len(requerimentos_por_aluno),
+        alunos_com_historico=alunos_com_historico_n,
+        total_qr=int(por_problema.get('QR', 0)),
+        total_ch=int(por_problema.get('CH', 0)),
+        taxa_aprovacao=por_status.get('aprovado', 0) / com_parecer * 100 if com_parecer > 0 else 0,
+        media_pedidos_por_aluno=pedidos_historico / alunos_com_historico_n if alunos_com_historico_n > 0 else 0,
+        top_disciplinas=por_disciplina[por_disciplina > 0].sort_values(ascending=False, kind='stable').head(5),
+        distribuicao_temporal=por_periodo[por_periodo > 0],
+    )
+
+def approval_by_discipline(cubo):
+    """Pedidos com parecer e taxa de aprovação por disciplina, lidos do cubo."""
+    por_status = cubo.count(by=['disciplina', 'status'], status=['aprovado', 'negado'])
+    com_parecer = por_status.sum(axis=1)
+    tabela = pd.DataFrame({'Pedidos com parecer': com_parecer, 'Aprovados': por_status.get('aprovado', 0)})
+    tabela = tabela[com_parecer > 0]
+    tabela['Taxa de aprovação (%)'] = (tabela['Aprovados'] / tabela['Pedidos com parecer'] * 100).round(1)
+    tabela.index = tabela.index.astype(str).rename('Disciplina')
+    return tabela.sort_values('Pedidos com parecer', ascending=False, kind='stable')
+
+# --- Detalhes por aluno ---
+STUDENT_PAGE_SIZES = [10, 25, 50, 100]
+
+def build_search_index(alunos):
+    """Índice de busca sobre `alunos` (colunas nusp e Nome completo, na ordem de exibição).
+
+    Guarda, ordenadas, as chaves de prefixo dos nomes sem acentos (uma por palavra, com o restante do
+    nome a partir dela, para que "silva" ou "maria s" encontrem "Maria Silva") e um dicionário NUSP ->
+    posição. As buscas usam `searchsorted` e não percorrem o DataFrame.
+    """
+    nomes = fold_text(alunos['Nome completo'].astype(str)).str.split().tolist()
+    chaves, posicoes = [], []
+    for posicao, palavras in enumerate(nomes):
+        for i in range(len(palavras)):
+            chaves.append(" ".join(palavras[i:]))
+            posicoes.append(posicao)
+    ordem = np.argsort(chaves, kind='stable')
+    return {
+        "chaves": np.array(chaves, dtype=str)[ordem],
+        "posicoes": np.array(posicoes, dtype=np.int64)[ordem],
+        "por_nusp": {int(nusp): posicao for posicao, nusp in enumerate(alunos['nusp'])},
+    }
+
+def search_students(indice, consulta):
+    """Posições (em ordem de exibição) dos alunos cujo nome tem uma palavra iniciada pela consulta, ou NUSP igual a ela."""
+    consulta = consulta.strip()
+    if consulta.isdigit():
+        posicao = indice["por_nusp"].get(int(consulta))
+        return np.array([] if posicao is None else [posicao], dtype=np.int64)
+    termo = " ".join(fold_text(pd.Series([consulta])).iloc[0].split())
+    inicio = np.searchsorted(indice["chaves"], termo, side='left')
+    fim = np.searchsorted(indice["chaves"], termo + "\uffff", side='left')
+    return np.unique(indice["posicoes"][inicio:fim])
+
+def student_detail_tables(historico_aluno, requerimentos_aluno):
+    """Tabelas de um aluno, as mesmas no painel de detalhes e no dossiê: requerimentos atuais, pedidos deferidos e histórico completo."""
+    problemas_atuais = requerimentos_aluno[['problema_atual']].drop_duplicates().rename(columns={'problema_atual': 'Problema'})
+    # **ALTERAÇÃO**: Adiciona a coluna 'problema_historico'
+    cols_deferidos = ['disciplina_historico', 'Ano_historico', 'Semestre_historico', 'problema_historico', 'parecer_historico']
+    pedidos_deferidos = historico_aluno.loc[historico_aluno['status_historico'] == 'aprovado', cols_deferidos]
+    cols_historico_completo = ['disciplina_historico', 'Ano_historico', 'Semestre_historico', 'problema_formatado', 'parecer_formatado']
+    return {
+        "Requerimentos": problemas_atuais,
+        "Deferidos": pedidos_deferidos.rename(columns=lambda c: c.replace('_historico', '')).reset_index(drop=True),
+        "Historico": historico_aluno[cols_historico_completo].rename(columns=lambda c: c.replace('_historico', '').replace('_formatado','')).reset_index(drop=True),
+    }
+
+def render_student_details(historico_aluno, requerimentos_aluno):
+    """Tabelas de um aluno: requerimentos atuais, pedidos deferidos e histórico completo."""
+    tabelas = student_detail_tables(historico_aluno, requerimentos_aluno)
+    # **NOVO**: Exibe o problema do requerimento atual
+    st.write("##### 📌 Requerimento(s) no Semestre Atual:")
+    st.dataframe(tabelas["Requerimentos"], hide_index=True)
+    st.write("---")
+
+    if not tabelas["Deferidos"].empty:
+        st.write("##### ✅ Pedidos Deferidos Anteriormente:")
+        st.dataframe(tabelas["Deferidos"])
+    else:
+        st.info("Este aluno não possui pedidos deferidos no histórico.")
+
+    st.write("---")
+    st.write("##### 📜 Histórico Completo de Pedidos:")
+    st.dataframe(tabelas["Historico"])
+
+# --- Dossiês por aluno ---
+# Alunos por tarefa enviada ao pool (amortiza o custo de enviar cada tarefa a outro processo).
+DOSSIER_BATCH_SIZE = 25
+DOSSIER_MAX_WORKERS = os.cpu_count() or 1
+
+def build_dossier_zip(detalhes):
+    """Um .xlsx por aluno com histórico (as tabelas do painel de detalhes), reunidos num .zip.
+
+    Os lotes de alunos são gravados em paralelo num pool de processos, com barra de progresso.
+    """
+    alunos = detalhes["alunos_unicos"]
+    tarefas = []
+    for inicio_lote in range(0, len(alunos), DOSSIER_BATCH_SIZE):
+        lote, alunos_lote = [], alunos.iloc[inicio_lote:inicio_lote + DOSSIER_BATCH_SIZE]
+        for nusp_aluno, nome_aluno in zip(alunos_lote['nusp'], alunos_lote['Nome completo']):
+            inicio, fim = detalhes["indice_alunos"][nusp_aluno]
+            inicio_req, fim_req = detalhes["indice_requerimentos"][nusp_aluno]
+            tabelas = student_detail_tables(detalhes["df_display"].iloc[inicio:fim], detalhes["requerimentos_display"].iloc[inicio_req:fim_req])
+            lote.append((nusp_aluno, nome_aluno, tabelas))
+        tarefas.append(lote)
+
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Relatorio')
-        workbook = writer.book
-        worksheet = writer.sheets['Relatorio']
-        header_format = workbook.add_format({'bold': True, 'text_wrap': True, 'valign': 'top', 'fg_color': '#D7E4BD', 'border': 1})
-        for col_num, value in enumerate(df.columns.values):
-            worksheet.write(0, col_num, value, header_format)
-        for i, col in enumerate(df.columns):
-            column_width = max(df[col].astype(str).map(len).max(), len(str(col))) + 2
-            worksheet.set_column(i, i, min(column_width, 50))
+    progresso = st.progress(0.0, text=f"Gerando dossiês: 0/{len(alunos)}")
+    prontos = 0
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED) as zip_file:
+        def guardar(arquivos):
+            nonlocal prontos
+            # .xlsx já é compactado: os arquivos entram no zip sem nova compressão.
+            for nome_arquivo, dados in arquivos:
+                zip_file.writestr(nome_arquivo, dados)
+            prontos += len(arquivos)
+            progresso.progress(prontos / len(alunos), text=f"Gerando dossiês: {prontos}/{len(alunos)}")
+
+        if len(tarefas) <= 1 or DOSSIER_MAX_WORKERS <= 1:
+            for lote in tarefas:
+                guardar(build_dossiers(lote))
+        else:
+            with process_pool(min(len(tarefas), DOSSIER_MAX_WORKERS)) as pool:
+                for futuro in as_completed([pool.submit(build_dossiers, lote) for lote in tarefas]):
+                    guardar(futuro.result())
+    progresso.empty()
     return output.getvalue()
 
-def find_and_rename_nusp_column(df, possible_names):
-    # Renomeia também a coluna 'problema' para um padrão, se existir
-    for col in df.columns:
-        if col.lower().strip() == 'problema':
-            df.rename(columns={col: "problema"}, inplace=True)
-
-    normalized_possible_names = [name.lower().strip() for name in possible_names]
-    for col in df.columns:
-        normalized_col = col.lower().strip()
-        if normalized_col in normalized_possible_names or any(keyword in normalized_col for keyword in ['nusp', 'numero usp', 'número usp', 'n° usp']):
-            df.rename(columns={col: "nusp"}, inplace=True)
-            return df
-    raise ValueError(f"Coluna de Número USP não encontrada. Colunas disponíveis: {', '.join(df.columns.tolist())}")
-
-def validate_dataframes(df_consolidado, df_requerimentos):
-    required_cols_consolidado_orig = ['nusp', 'disciplina', 'Ano', 'Semestre', 'problema', 'parecer']
-    # **ALTERAÇÃO**: Agora a coluna 'problema' também é obrigatória no arquivo de requerimentos
-    required_cols_requerimentos = ['nusp', 'Nome completo', 'problema']
-    
-    missing_consolidado = [col for col in required_cols_consolidado_orig if col not in df_consolidado.columns]
-    missing_requerimentos = [col for col in required_cols_requerimentos if col not in df_requerimentos.columns]
-    
-    errors = []
-    if missing_consolidado: errors.append(f"Arquivo consolidado: colunas faltando - {', '.join(missing_consolidado)}")
-    if missing_requerimentos: errors.append(f"Arquivo requerimentos: colunas faltando - {', '.join(missing_requerimentos)}")
-    if errors: raise ValueError("\n".join(errors))
-
-def calculate_additional_metrics(alunos_com_historico):
-    metrics = {}
-    if not alunos_com_historico.empty:
-        pareceres = alunos_com_historico['parecer_historico'].str.lower()
-        aprovados = pareceres.str.contains('aprovado', na=False) & ~pareceres.str.contains('indeferido|negado', na=False)
-        negados = pareceres.str.contains('indeferido|negado', na=False)
-        
-        total_aprovados = aprovados.sum()
-        total_negados = negados.sum()
-        total_com_parecer = total_aprovados + total_negados
-        
-        metrics['taxa_aprovacao'] = (total_aprovados / total_com_parecer * 100) if total_com_parecer > 0 else 0
-        metrics['media_pedidos_por_aluno'] = len(alunos_com_historico) / alunos_com_historico['nusp'].nunique()
-        metrics['top_disciplinas'] = alunos_com_historico['disciplina_historico'].value_counts().head(5)
-        if 'Ano_historico' in alunos_com_historico.columns and 'Semestre_historico' in alunos_com_historico.columns:
-            alunos_com_historico['periodo'] = alunos_com_historico['Ano_historico'].astype(str) + '/' + alunos_com_historico['Semestre_historico'].astype(str)
-            metrics['distribuicao_temporal'] = alunos_com_historico['periodo'].value_counts().sort_index()
-    return metrics
+# --- Processamento em etapas (resultado mantido na sessão) ---
+# Cada etapa é guardada pela impressão digital das suas entradas: reenviar só os requerimentos
+# reaproveita o histórico já normalizado e classificado; mudar o léxico refaz só a classificação e o cruzamento.
+#
+#   histórico (arquivos ou armazenado) ──> normalização ──> classificação (+ léxico) ──┐
+#   requerimentos ──────────────────────> normalização ──────────────────────────────┴──> cruzamento
+PIPELINE_CACHE_MAX_ENTRIES = 12
+
+@st.cache_resource
+def get_stage_cache():
+    """Saídas das etapas do processamento, indexadas pela etapa e pelas impressões digitais das entradas."""
+    return LRUCache(PIPELINE_CACHE_MAX_ENTRIES)
+
+def files_fingerprint(uploaded_files):
+    return hashlib.sha256(b"".join(hashlib.sha256(f.getvalue()).digest() for f in uploaded_files)).hexdigest()
+
+def run_stage(nome, entradas, funcao, etapas):
+    """Executa `funcao()` ou reaproveita a saída guardada para a mesma etapa com as mesmas entradas.
+
+    Registra em `etapas` o nome, se foi reaproveitada e o tempo gasto. Retorna (impressão digital da
+    etapa, que alimenta as etapas seguintes, e a saída). Saídas None (leitura interrompida) não são guardadas.
+    As saídas são compartilhadas: as etapas seguintes não devem alterá-las no lugar.
+    """
+    chave = hashlib.sha256(repr((nome, entradas)).encode()).hexdigest()
+    cache = get_stage_cache()
+    saida = cache.get(chave)
+    reaproveitada = saida is not None
+    inicio = time.perf_counter()
+    if not reaproveitada:
+        saida = funcao()
+        if saida is not None:
+            cache.put(chave, saida)
+    etapas.append((nome, reaproveitada, time.perf_counter() - inicio))
+    return chave, saida
+
+def normalize_stage(df, nome, required_cols, schema):
+    """Validação, NUSP e tipos compactos de uma tabela carregada; devolve também os avisos e as linhas rejeitadas."""
+    validate_columns(df, required_cols, nome)
+    avisos = []
+    memoria_antes = memory_mb(df)
+    df, rejeitados, recuperados = normalize_nusp(df)
+    if recuperados > 0:
+        avisos.append(("info", f"ℹ️ {recuperados} NUSPs do arquivo {nome} estavam como texto (ex.: '12.345.678') e foram recuperados."))
+    if not rejeitados.empty:
+        avisos.append(("warning", f"⚠️ Removidos {len(rejeitados)} registros com NUSP inválido do arquivo {nome}"))
+    apply_schema(df, schema)
+    return {"df": df, "avisos": avisos, "rejeitados": rejeitados.assign(arquivo=nome), "memoria_antes": memoria_antes, "memoria_depois": memory_mb(df)}
+
+def load_and_normalize_history(file_consolidado, store_info):
+    if file_consolidado:
+        df, infos = load_data(file_consolidado, REQUIRED_COLS_CONSOLIDADO, all_sheets=True)
+    else:
+        df, infos = load_history_store(store_info)
+    if df is None:
+        return None
+    return {**normalize_stage(df, "consolidado", REQUIRED_COLS_CONSOLIDADO, SCHEMA_CONSOLIDADO), "leitura": infos, "colunas_lidas": df.columns.tolist()}
+
+def load_and_normalize_requests(file_requerimentos):
+    df, infos = load_data([file_requerimentos], REQUIRED_COLS_REQUERIMENTOS)
+    if df is None:
+        return None
+    colunas_lidas = df.columns.tolist()
+    normalizado = normalize_stage(df, "requerimentos", REQUIRED_COLS_REQUERIMENTOS, SCHEMA_REQUERIMENTOS)
+    # **ALTERAÇÃO**: Renomeia a coluna 'problema' do arquivo de requerimentos para evitar conflito no merge
+    normalizado["df"].rename(columns={'problema': 'problema_atual'}, inplace=True)
+    return {**normalizado, "leitura": infos, "colunas_lidas": colunas_lidas}
+
+def classify_history(historico, conteudo_lexico):
+    """Acrescenta o status do parecer e o sufixo _historico às colunas, sem alterar a saída da normalização."""
+    lexico = load_lexicon(conteudo_lexico)
+    inicio_classificacao = time.perf_counter()
+    df = historico.copy(deep=False)
+    df['status'] = classify_parecer(df['parecer'], lexico)
+    tempo_classificacao = time.perf_counter() - inicio_classificacao
+    cols_to_rename = {col: f"{col}_historico" for col in ['disciplina', 'Ano', 'Semestre', 'problema', 'parecer', 'status']}
+    return {"df": df.rename(columns=cols_to_rename, copy=False), "lexico": lexico, "pareceres_distintos": df['parecer'].nunique(), "tempo_classificacao": tempo_classificacao}
+
+def cross_tables(df_requerimentos, df_consolidado):
+    requerimentos_por_aluno, alunos_com_historico = build_result_tables(df_requerimentos, df_consolidado)
+    alunos_com_historico['periodo'] = period_column(alunos_com_historico)
+    inicio_cubo = time.perf_counter()
+    cubo = build_count_cube(alunos_com_historico)
+    tempo_cubo = time.perf_counter() - inicio_cubo
+    return {
+        "requerimentos_por_aluno": requerimentos_por_aluno,
+        "alunos_com_historico": alunos_com_historico,
+        "cubo": cubo,
+        "tempo_cubo": tempo_cubo,
+        "metrics": compute_metrics(df_requerimentos, requerimentos_por_aluno, alunos_com_historico, cubo),
+        "detalhes": prepare_student_details(alunos_com_historico, df_requerimentos),
+    }
+
+def run_pipeline(file_consolidado, store_info, file_requerimentos, conteudo_lexico, impressoes):
+    """Executa (ou reaproveita) as etapas e devolve tudo o que as seções da página exibem.
+
+    Mensagens para o usuário são devolvidas em `avisos` (e não exibidas aqui) para que sejam repetidas
+    quando o resultado for reaproveitado. Retorna None se a leitura depender do mapeamento manual.
+    """
+    etapas = []
+    chave_historico, historico = run_stage("histórico normalizado", impressoes["consolidado"], lambda: load_and_normalize_history(file_consolidado, store_info), etapas)
+    chave_requerimentos, requerimentos = run_stage("requerimentos normalizados", impressoes["requerimentos"], lambda: load_and_normalize_requests(file_requerimentos), etapas)
+    if historico is None or requerimentos is None:
+        return None
+    chave_classificacao, classificado = run_stage("classificação dos pareceres", (chave_historico, impressoes["lexico"]), lambda: classify_history(historico["df"], conteudo_lexico), etapas)
+    chave_cruzamento, cruzamento = run_stage("cruzamento e métricas", (chave_classificacao, chave_requerimentos), lambda: cross_tables(requerimentos["df"], classificado["df"]), etapas)
+
+    rejeitados = pd.concat([historico["rejeitados"], requerimentos["rejeitados"]], ignore_index=True)
+    return {
+        **cruzamento,
+        "impressao": chave_cruzamento,
+        "historico": historico["df"],
+        "df_requerimentos": requerimentos["df"],
+        "avisos": historico["avisos"] + requerimentos["avisos"],
+        "rejeitados_csv": rejeitados.to_csv(index=False).encode('utf-8') if not rejeitados.empty else None,
+        "leitura": {"Consolidado": historico["leitura"], "Requerimentos": requerimentos["leitura"]},
+        "colunas_lidas": {"Consolidado": historico["colunas_lidas"], "Requerimentos": requerimentos["colunas_lidas"]},
+        "debug": {
+            "etapas": etapas,
+            "lexico": classificado["lexico"],
+            "pareceres_distintos": classificado["pareceres_distintos"],
+            "tempo_classificacao": classificado["tempo_classificacao"],
+            "memoria_antes": historico["memoria_antes"] + requerimentos["memoria_antes"],
+            "memoria_depois": historico["memoria_depois"] + requerimentos["memoria_depois"],
+        },
+    }
+
+def get_pipeline_result(file_consolidado, store_info, file_requerimentos):
+    """Resultado do processamento, reaproveitado da sessão enquanto os arquivos e o léxico não mudarem.
+
+    Assim, interações que só mudam a exibição (debug, formato de exportação, busca) não refazem a leitura e o cruzamento.
+    """
+    conteudo_lexico = read_lexicon()
+    mapeamentos = manual_mappings_fingerprint()
+    impressoes = {
+        "consolidado": (files_fingerprint(file_consolidado), mapeamentos) if file_consolidado else repr(store_info["assinatura"]),
+        "requerimentos": (files_fingerprint([file_requerimentos]), mapeamentos),
+        "lexico": hashlib.sha256(conteudo_lexico.encode()).hexdigest(),
+    }
+    chave = tuple(impressoes.values())
+    guardado = st.session_state.get("resultado_processamento")
+    if guardado is not None and guardado[0] == chave:
+        return guardado[1]
+    with st.spinner("Processando arquivos... Por favor, aguarde."):
+        resultado = run_pipeline(file_consolidado, store_info, file_requerimentos, conteudo_lexico, impressoes)
+    if resultado is not None:
+        st.session_state["resultado_processamento"] = (chave, resultado)
+    return resultado
+
+def prepare_student_details(alunos_com_historico, df_requerimentos):
+    """Índices por aluno, colunas de exibição e índice de busca, montados uma vez por resultado do processamento."""
+    df_display, indice_alunos = build_student_index(alunos_com_historico)
+    requerimentos_display, indice_requerimentos = build_student_index(df_requerimentos)
+    # Colunas de exibição calculadas uma vez para todos os alunos, fora do laço de renderização.
+    df_display['parecer_formatado'] = format_parecer_column(df_display['parecer_historico'], df_display['status_historico'])
+    df_display['problema_formatado'] = df_display['problema_historico'].map(format_problem_type, na_action=None)
+    alunos_unicos = df_display[['nusp', 'Nome completo']].drop_duplicates().sort_values('Nome completo').reset_index(drop=True)
+    return {
+        "df_display": df_display,
+        "indice_alunos": indice_alunos,
+        "requerimentos_display": requerimentos_display,
+        "indice_requerimentos": indice_requerimentos,
+        "alunos_unicos": alunos_unicos,
+        "indice_busca": build_search_index(alunos_unicos),
+    }
+
+@st.experimental_fragment
+def render_student_section(detalhes):
+    """Busca, paginação e detalhes dos alunos; as interações aqui reexecutam apenas esta seção."""
+    alunos_unicos = detalhes["alunos_unicos"]
+    consulta = st.text_input("🔎 Buscar aluno", placeholder="Nome (ou parte dele) ou NUSP", key="busca_aluno")
+    if consulta.strip():
+        alunos_unicos = alunos_unicos.iloc[search_students(detalhes["indice_busca"], consulta)]
+        if alunos_unicos.empty:
+            st.warning("Nenhum aluno com histórico encontrado para a busca.")
+
+    col_tamanho, col_pagina, col_resumo = st.columns([1, 1, 2])
+    with col_tamanho:
+        tamanho_pagina = st.selectbox("Alunos por página", STUDENT_PAGE_SIZES, index=1, key="tamanho_pagina")
+    total_paginas = max(1, -(-len(alunos_unicos) // tamanho_pagina))
+    # Mantém a página dentro do limite quando o tamanho da página ou os arquivos mudam.
+    st.session_state["pagina_alunos"] = min(st.session_state.get("pagina_alunos", 1), total_paginas)
+    with col_pagina:
+        pagina = st.number_input("Página", min_value=1, max_value=total_paginas, step=1, key="pagina_alunos")
+    with col_resumo:
+        st.caption(f"{len(alunos_unicos)} alunos {'encontrados' if consulta.strip() else 'com histórico'} — página {pagina} de {total_paginas}")
+
+    alunos_pagina = alunos_unicos.iloc[(pagina - 1) * tamanho_pagina:pagina * tamanho_pagina]
+    for nusp_aluno, nome_aluno in zip(alunos_pagina['nusp'], alunos_pagina['Nome completo']):
+        if st.toggle(f"👤 {nome_aluno} (NUSP: {nusp_aluno})", key=f"aluno_{nusp_aluno}"):
+            inicio, fim = detalhes["indice_alunos"][nusp_aluno]
+            inicio_req, fim_req = detalhes["indice_requerimentos"][nusp_aluno]
+            with st.container(border=True):
+                render_student_details(detalhes["df_display"].iloc[inicio:fim], detalhes["requerimentos_display"].iloc[inicio_req:fim_req])
+
+@st.experimental_fragment
+def render_export_section(alunos_com_historico, impressao):
+    """Exportação do relatório, gerada só quando o usuário pede; trocar o formato reexecuta apenas esta seção.
+
+    Um arquivo já preparado (nesta ou em outra sessão, para o mesmo resultado) vem direto do cache de exportação.
+    """
+    export_format = st.selectbox("Formato de exportação", list(EXPORT_FORMATS), key="export_format")
+    extensao, mime, gerar = EXPORT_FORMATS[export_format]
+    chave = (impressao, extensao)
+    cache = get_export_cache()
+    dados = cache.get(chave) if chave in cache else None
+
+    if dados is None:
+        st.caption("O arquivo é gerado apenas quando solicitado.")
+        if st.button("⚙️ Preparar arquivo", key="preparar_exportacao"):
+            with st.spinner(f"Gerando arquivo {export_format}..."):
+                dados = cached_export(impressao, extensao, lambda: gerar(alunos_com_historico))
+    if dados is not None:
+        file_name = f"relatorio_historico_completo_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extensao}"
+        st.download_button(f"📥 Baixar como {export_format} ({len(dados) / 1024 ** 2:.1f} MB)", dados, file_name, mime)
+
+@st.experimental_fragment
+def render_dossier_section(detalhes, impressao):
+    """Dossiês por aluno para as reuniões da comissão, gerados só quando pedidos (e guardados no cache de exportação)."""
+    chave = (impressao, "dossies.zip")
+    cache = get_export_cache()
+    dados = cache.get(chave) if chave in cache else None
+
+    if dados is None:
+        st.caption(f"Gera uma planilha por aluno com histórico ({len(detalhes['alunos_unicos'])} alunos), com os requerimentos atuais e o histórico completo.")
+        if st.button("⚙️ Gerar dossiês", key="gerar_dossies"):
+            dados = cached_export(impressao, "dossies.zip", lambda: build_dossier_zip(detalhes))
+    if dados is not None:
+        file_name = f"dossies_alunos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+        st.download_button(f"📥 Baixar dossiês ({len(dados) / 1024 ** 2:.1f} MB)", dados, file_name, "application/zip")
 
 # --- Função Principal da Aplicação ---
 def run_app():
@@ -156,74 +1094,98 @@ def run_app():
     with st.sidebar:
         st.header("📁 Upload de Arquivos")
         st.markdown("---")
-        file_consolidado = st.file_uploader("**Histórico de Pedidos (consolidado)**", type=["xlsx", "xls", "csv"], help="Arquivo: resultado_consolidado.xlsx")
+        store_info = history_store_info()
+        file_consolidado = st.file_uploader("**Histórico de Pedidos (consolidado)**", type=["xlsx", "xls", "csv"], accept_multiple_files=True, help="Arquivo: resultado_consolidado.xlsx, ou um arquivo por semestre (todas as abas com coluna de NUSP são lidas)" + (" — opcional, já existe um histórico armazenado no servidor" if store_info else ""))
+        if store_info:
+            st.caption(f"🗄️ Histórico armazenado: {store_info['registros']} registros em {store_info['semestres']} semestres, atualizado em {store_info['atualizado_em']:%d/%m/%Y %H:%M}. Envie um consolidado apenas para substituí-lo ou acrescentar um semestre.")
         file_requerimentos = st.file_uploader("**Pedidos do Semestre Atual (requerimentos)**", type=["xlsx", "xls", "csv"], help="Arquivo: lista_requerimentos_final.xlsx")
         st.markdown("---")
         st.info("💡 **Dica:** Os arquivos devem conter uma coluna com o número USP para o cruzamento dos dados.")
         with st.expander("⚙️ Configurações Avançadas"):
             show_debug = st.checkbox("Mostrar informações de debug", value=False)
-            export_format = st.selectbox("Formato de exportação", ["Excel", "CSV"])
+            if manual_mappings() and st.button("↩️ Redefinir mapeamento de colunas", help="Descarta as colunas indicadas manualmente nesta sessão; o formulário de mapeamento aparece de novo no próximo processamento."):
+                manual_mappings().clear()
+                st.rerun()
 
-    if not (file_consolidado and file_requerimentos):
+    if not ((file_consolidado or store_info) and file_requerimentos):
         col1, col2, col3 = st.columns([1, 2, 1])
         with col2:
-            st.markdown("### 🚀 Bem-vindo ao Sistema de Conferência!\nPara começar, faça o upload dos dois arquivos na barra lateral.")
+            if store_info:
+                st.markdown("### 🚀 Bem-vindo ao Sistema de Conferência!\nO histórico já está armazenado no servidor: para começar, faça o upload do arquivo de requerimentos na barra lateral.")
+            else:
+                st.markdown("### 🚀 Bem-vindo ao Sistema de Conferência!\nPara começar, faça o upload dos dois arquivos na barra lateral.")
             with st.expander("📋 Estrutura esperada dos arquivos"):
-                st.markdown("**Arquivo Consolidado:** `nusp`, `disciplina`, `Ano`, `Semestre`, `problema`, `parecer`\n**Arquivo de Requerimentos:** `nusp`, `Nome completo`, `problema`")
+                st.markdown("**Arquivo Consolidado:** `nusp`, `disciplina`, `Ano`, `Semestre`, `problema`, `parecer`\n**Arquivo de Requerimentos:** `nusp`, `Nome completo`, `problema`\n\nVariações comuns dos nomes (ex.: `Número USP`, `N° USP`, `ano`, `Disciplina `) são reconhecidas automaticamente; se alguma coluna não for encontrada, você poderá indicá-la manualmente.")
     else:
         try:
-            with st.spinner("Processando arquivos... Por favor, aguarde."):
-                df_consolidado = load_data(file_consolidado)
-                df_requerimentos = load_data(file_requerimentos)
-
-                if df_consolidado is None or df_requerimentos is None:
-                    st.stop()
-                
-                if show_debug:
-                    with st.expander("🔍 Debug - Colunas originais"):
-                        st.write("**Consolidado:**", df_consolidado.columns.tolist())
-                        st.write("**Requerimentos:**", df_requerimentos.columns.tolist())
-                        
-                df_consolidado = find_and_rename_nusp_column(df_consolidado, ["nusp", "numero usp", "número usp", "n° usp", "n usp"])
-                df_requerimentos = find_and_rename_nusp_column(df_requerimentos, ["nusp", "número usp", "numero usp", "n° usp", "n usp"])
-                
-                validate_dataframes(df_consolidado, df_requerimentos)
-                
-                for df, nome in [(df_consolidado, "consolidado"), (df_requerimentos, "requerimentos")]:
-                    df["nusp"] = pd.to_numeric(df["nusp"], errors='coerce')
-                    nulos_antes = df["nusp"].isna().sum()
-                    df.dropna(subset=["nusp"], inplace=True)
-                    if nulos_antes > 0:
-                        st.warning(f"⚠️ Removidos {nulos_antes} registros com NUSP inválido do arquivo {nome}")
-                    df["nusp"] = df["nusp"].astype(int)
-                
-                cols_to_rename = {col: f"{col}_historico" for col in ['disciplina', 'Ano', 'Semestre', 'problema', 'parecer']}
-                df_consolidado.rename(columns=cols_to_rename, inplace=True)
-
-                # **ALTERAÇÃO**: Renomeia a coluna 'problema' do arquivo de requerimentos para evitar conflito no merge
-                df_requerimentos.rename(columns={'problema': 'problema_atual'}, inplace=True)
-
-                alunos_com_historico = df_requerimentos.merge(df_consolidado, on="nusp", how="inner")
-                metrics = calculate_additional_metrics(alunos_com_historico)
+            resultado = get_pipeline_result(file_consolidado, store_info, file_requerimentos)
+            if resultado is None:
+                st.stop()
+            alunos_com_historico = resultado["alunos_com_historico"]
+            metrics = resultado["metrics"]
+
+            if show_debug:
+                with st.expander("🔍 Debug - Colunas lidas"):
+                    for nome, colunas in resultado["colunas_lidas"].items():
+                        st.write(f"**{nome}:**", colunas)
+                    for nome, infos in resultado["leitura"].items():
+                        for info in infos:
+                            origem = "cache" if info["cache"] else "leitura"
+                            aba = f" (aba {info['aba']})" if isinstance(info.get("aba"), str) else ""
+                            st.write(f"**Leitura {nome}:** {info['arquivo']}{aba} — {describe_format(info)}, {info['colunas']} colunas — {origem}")
+                            renomeadas = {str(orig): padrao for orig, padrao in info.get("mapeamento", {}).items() if orig != padrao}
+                            if renomeadas:
+                                st.write("Colunas renomeadas:", renomeadas)
+                    parse_cache = get_parse_cache()
+                    st.write(f"**Cache de leitura:** {len(parse_cache)}/{parse_cache.max_entries} arquivos, {parse_cache.hits} acertos, {parse_cache.misses} leituras")
+                    schema_cache = get_schema_cache()
+                    st.write(f"**Cache de mapeamento de colunas:** {len(schema_cache)} formatos, {schema_cache.hits} acertos, {schema_cache.misses} resoluções; {len(manual_mappings())} mapeamentos manuais nesta sessão")
+
+            for tipo, mensagem in resultado["avisos"]:
+                getattr(st, tipo)(mensagem)
+            if resultado["rejeitados_csv"] is not None:
+                st.download_button("📥 Baixar registros rejeitados (CSV)", resultado["rejeitados_csv"], "nusp_rejeitados.csv", "text/csv")
+
+            if file_consolidado:
+                historico = resultado["historico"]
+                if st.sidebar.button("💾 Salvar histórico no servidor", help="Substitui o histórico armazenado por este consolidado, para que as próximas sessões precisem apenas do arquivo de requerimentos."):
+                    if historico.empty:
+                        st.sidebar.warning("O consolidado não tem registros válidos: o histórico armazenado não foi alterado.")
+                    else:
+                        save_history_store(historico)
+                        st.sidebar.success(f"Histórico salvo: {len(historico)} registros.")
+                if store_info and st.sidebar.button("➕ Acrescentar semestre ao histórico", help="Grava apenas as linhas deste arquivo que ainda não estão no histórico armazenado."):
+                    gravadas, ignoradas = append_semester(historico)
+                    st.sidebar.success(f"Semestre acrescentado: {gravadas} registros novos, {ignoradas} já existentes ignorados.")
+
+            if show_debug:
+                debug = resultado["debug"]
+                with st.expander("🔍 Debug - Processamento"):
+                    st.write("**Etapas do processamento:** " + "; ".join(f"{nome} — {'reaproveitada' if reaproveitada else f'calculada em {tempo * 1000:.0f} ms'}" for nome, reaproveitada, tempo in debug['etapas']))
+                    stage_cache = get_stage_cache()
+                    st.write(f"**Cache de etapas:** {len(stage_cache)}/{stage_cache.max_entries} saídas, {stage_cache.hits} acertos, {stage_cache.misses} execuções")
+                    export_cache = get_export_cache()
+                    st.write(f"**Cache de exportação:** {len(export_cache)}/{export_cache.max_entries} arquivos, {export_cache.bytes / 1024 ** 2:.1f} de {export_cache.max_bytes / 1024 ** 2:.0f} MB, {export_cache.hits} acertos, {export_cache.misses} gerações")
+                    st.write(f"**Léxico de pareceres:** {debug['lexico']['regras']} regras; {debug['pareceres_distintos']} pareceres distintos classificados em {debug['tempo_classificacao'] * 1000:.1f} ms")
+                    st.write(f"**Arquivos carregados:** {debug['memoria_antes']:.1f} MB antes dos tipos compactos, {debug['memoria_depois']:.1f} MB depois")
+                    cubo = resultado["cubo"]
+                    st.write(f"**Cubo de contagens:** {' × '.join(f'{len(cats)} {dim}' for dim, cats in cubo.categorias.items())} ({cubo.nbytes / 1024:.0f} KB), montado em {resultado['tempo_cubo'] * 1000:.1f} ms")
+                    st.write(f"**Alunos com histórico:** {memory_mb(alunos_com_historico):.1f} MB ({len(alunos_com_historico)} linhas de histórico de {len(resultado['requerimentos_por_aluno'])} alunos atuais)")
+                    st.write("**Tipos:**", alunos_com_historico.dtypes.astype(str).to_dict())
 
             st.markdown("### 📊 Métricas Principais")
             # ... (código das métricas permanece o mesmo) ...
             col1, col2, col3, col4, col5 = st.columns(5)
             with col1:
-                st.metric("Total de Requerimentos", len(df_requerimentos), help="Total de pedidos no semestre atual")
+                st.metric("Total de Requerimentos", metrics.total_requerimentos, help="Total de pedidos no semestre atual")
             with col2:
-                alunos_unicos_historico = alunos_com_historico["nusp"].nunique()
-                percentual_historico = (alunos_unicos_historico / df_requerimentos["nusp"].nunique() * 100) if df_requerimentos["nusp"].nunique() > 0 else 0
-                st.metric("Alunos com Histórico", alunos_unicos_historico, f"{percentual_historico:.1f}%", help="Alunos que já fizeram pedidos anteriormente")
+                st.metric("Alunos com Histórico", metrics.alunos_com_historico, f"{metrics.percentual_com_historico:.1f}%", help="Alunos que já fizeram pedidos anteriormente")
             with col3:
-                total_qr = (alunos_com_historico["problema_historico"].str.upper() == "QR").sum()
-                st.metric("Quebras de Requisito", total_qr, help="Total de QR no histórico dos alunos recorrentes")
+                st.metric("Quebras de Requisito", metrics.total_qr, help="Total de QR no histórico dos alunos recorrentes")
             with col4:
-                total_ch = (alunos_com_historico["problema_historico"].str.upper() == "CH").sum()
-                st.metric("Conflitos de Horário", total_ch, help="Total de CH no histórico dos alunos recorrentes")
+                st.metric("Conflitos de Horário", metrics.total_ch, help="Total de CH no histórico dos alunos recorrentes")
             with col5:
-                taxa_aprovacao = metrics.get('taxa_aprovacao', 0)
-                st.metric("Taxa de Aprovação (Hist.)", f"{taxa_aprovacao:.1f}%", help="Percentual de pedidos aprovados no histórico")
+                st.metric("Taxa de Aprovação (Hist.)", f"{metrics.taxa_aprovacao:.1f}%", help="Percentual de pedidos aprovados no histórico")
 
 
             st.markdown("---")
@@ -234,68 +1196,50 @@ def run_app():
                 col_chart1, col_chart2 = st.columns(2)
                 with col_chart1:
                     st.markdown("##### 📚 Top 5 Disciplinas com Histórico")
-                    if 'top_disciplinas' in metrics and not metrics['top_disciplinas'].empty:
-                        fig = px.bar(metrics['top_disciplinas'], x=metrics['top_disciplinas'].values, y=metrics['top_disciplinas'].index, orientation='h', labels={'x': 'Nº de Pedidos', 'y': 'Disciplina'}, text=metrics['top_disciplinas'].values)
+                    if not metrics.top_disciplinas.empty:
+                        fig = px.bar(metrics.top_disciplinas, x=metrics.top_disciplinas.values, y=metrics.top_disciplinas.index.astype(str), orientation='h', labels={'x': 'Nº de Pedidos', 'y': 'Disciplina'}, text=metrics.top_disciplinas.values)
                         fig.update_layout(yaxis={'categoryorder':'total ascending'})
                         st.plotly_chart(fig, use_container_width=True)
                 with col_chart2:
                     st.markdown("##### 🗓️ Pedidos por Período")
-                    if 'distribuicao_temporal' in metrics and not metrics['distribuicao_temporal'].empty:
-                        fig2 = px.line(metrics['distribuicao_temporal'], x=metrics['distribuicao_temporal'].index, y=metrics['distribuicao_temporal'].values, labels={'x': 'Período', 'y': 'Nº de Pedidos'}, markers=True)
+                    if not metrics.distribuicao_temporal.empty:
+                        fig2 = px.line(metrics.distribuicao_temporal, x=metrics.distribuicao_temporal.index.astype(str), y=metrics.distribuicao_temporal.values, labels={'x': 'Período', 'y': 'Nº de Pedidos'}, markers=True)
                         st.plotly_chart(fig2, use_container_width=True)
 
+                # Recortes do mesmo cubo de contagens que alimenta as métricas e os gráficos acima.
+                with st.expander("🔎 Aprovação por disciplina e quebras de requisito por período"):
+                    col_drill1, col_drill2 = st.columns(2)
+                    with col_drill1:
+                        st.markdown("##### ✅ Aprovação por Disciplina")
+                        st.dataframe(approval_by_discipline(resultado["cubo"]), use_container_width=True)
+                    with col_drill2:
+                        st.markdown("##### 🔴 Quebras de Requisito por Período")
+                        qr_por_periodo = resultado["cubo"].count(by=['periodo'], problema='QR')
+                        qr_por_periodo = qr_por_periodo[metrics.distribuicao_temporal.index]
+                        if qr_por_periodo.sum() > 0:
+                            fig3 = px.line(qr_por_periodo, x=qr_por_periodo.index.astype(str), y=qr_por_periodo.values, labels={'x': 'Período', 'y': 'Nº de QR'}, markers=True)
+                            st.plotly_chart(fig3, use_container_width=True)
+                        else:
+                            st.info("Nenhuma quebra de requisito no histórico destes alunos.")
+
                 st.markdown("---")
                 st.markdown("### 📋 Detalhes por Aluno com Histórico de Pedidos")
-                st.info("Clique no nome de um aluno para expandir e ver seu histórico completo de pedidos.")
-
-                df_display = alunos_com_historico.copy()
-                alunos_unicos = df_display[['nusp', 'Nome completo']].drop_duplicates().sort_values('Nome completo')
-
-                for _, aluno in alunos_unicos.iterrows():
-                    nome_aluno = aluno['Nome completo']
-                    nusp_aluno = aluno['nusp']
-
-                    with st.expander(f"👤 {nome_aluno} (NUSP: {nusp_aluno})"):
-                        historico_aluno = df_display[df_display['nusp'] == nusp_aluno].copy()
-                        
-                        # **NOVO**: Exibe o problema do requerimento atual
-                        st.write("##### 📌 Requerimento(s) no Semestre Atual:")
-                        problemas_atuais = historico_aluno[['problema_atual']].drop_duplicates().rename(columns={'problema_atual': 'Problema'})
-                        st.dataframe(problemas_atuais, hide_index=True)
-                        st.write("---")
-
-                        historico_aluno['parecer_formatado'] = historico_aluno['parecer_historico'].apply(format_parecer)
-                        pedidos_deferidos = historico_aluno[historico_aluno['parecer_formatado'].str.startswith('✅')]
-
-                        if not pedidos_deferidos.empty:
-                            st.write("##### ✅ Pedidos Deferidos Anteriormente:")
-                            # **ALTERAÇÃO**: Adiciona a coluna 'problema_historico'
-                            cols_deferidos = ['disciplina_historico', 'Ano_historico', 'Semestre_historico', 'problema_historico', 'parecer_historico']
-                            st.dataframe(pedidos_deferidos[cols_deferidos].rename(columns=lambda c: c.replace('_historico', '')).reset_index(drop=True))
-                        else:
-                            st.info("Este aluno não possui pedidos deferidos no histórico.")
+                st.info("Ative o nome de um aluno para ver seu histórico completo de pedidos. Os detalhes são montados apenas para os alunos abertos.")
 
-                        st.write("---")
-                        st.write("##### 📜 Histórico Completo de Pedidos:")
-                        historico_aluno['problema_formatado'] = historico_aluno['problema_historico'].apply(format_problem_type)
-                        cols_historico_completo = ['disciplina_historico', 'Ano_historico', 'Semestre_historico', 'problema_formatado', 'parecer_formatado']
-                        st.dataframe(historico_aluno[cols_historico_completo].rename(columns=lambda c: c.replace('_historico', '').replace('_formatado','')).reset_index(drop=True))
+                render_student_section(resultado["detalhes"])
 
                 st.markdown("---")
                 st.markdown("### 📥 Exportar Relatório Completo")
-                
-                file_name = f"relatorio_historico_completo_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                df_export = alunos_com_historico.copy()
-                
-                if export_format == "Excel":
-                    excel_data = to_excel(df_export)
-                    st.download_button("📥 Baixar como Excel", excel_data, f"{file_name}.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-                else: 
-                    csv_data = df_export.to_csv(index=False).encode('utf-8')
-                    st.download_button("📥 Baixar como CSV", csv_data, f"{file_name}.csv", "text/csv")
+                render_export_section(alunos_com_historico, resultado["impressao"])
+
+                st.markdown("---")
+                st.markdown("### 🗂️ Dossiês por Aluno")
+                render_dossier_section(resultado["detalhes"], resultado["impressao"])
             else:
                 st.success("✅ Nenhum aluno do semestre atual foi encontrado no histórico de pedidos.")
 
+        except LexiconError as e:
+            st.error(f"❌ **Erro no léxico de pareceres:**\n\n{e}\n\nCorrija o arquivo {os.path.basename(LEXICON_PATH)} no servidor; os arquivos enviados não precisam ser alterados.")
         except ValueError as e:
             st.error(f"❌ **Erro de Validação:**\n\n{e}\n\nPor favor, verifique a estrutura dos seus arquivos.")
         except Exception as e:
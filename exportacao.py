@@ -0,0 +1,106 @@
+"""Gravação dos arquivos exportados: relatório em Excel, CSV ou Parquet e dossiês por aluno."""
+import re
+import unicodedata
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+
+# Linhas convertidas e gravadas por vez na exportação para Excel, e linhas amostradas para a largura das colunas.
+EXCEL_CHUNK_ROWS = 5_000
+EXCEL_WIDTH_SAMPLE_ROWS = 2_000
+EXCEL_MAX_COLUMN_WIDTH = 50
+
+def estimate_column_widths(df):
+    """Largura de cada coluna pela maior célula de uma amostra limitada de linhas (`str.len()` vetorizado)."""
+    amostra = df.sample(EXCEL_WIDTH_SAMPLE_ROWS, random_state=0) if len(df) > EXCEL_WIDTH_SAMPLE_ROWS else df
+    larguras = []
+    for col in df.columns:
+        maior = amostra[col].astype(str).str.len().max() if len(amostra) else 0
+        larguras.append(min(max(maior, len(str(col))) + 2, EXCEL_MAX_COLUMN_WIDTH))
+    return larguras
+
+def write_sheet(workbook, sheet_name, df):
+    """Grava `df` numa nova aba, em blocos de `EXCEL_CHUNK_ROWS` linhas e em ordem (exigência do modo `constant_memory`)."""
+    worksheet = workbook.add_worksheet(sheet_name)
+    header_format = workbook.add_format({'bold': True, 'text_wrap': True, 'valign': 'top', 'fg_color': '#D7E4BD', 'border': 1})
+    # No modo constant_memory as larguras precisam ser definidas antes da primeira linha.
+    for i, largura in enumerate(estimate_column_widths(df)):
+        worksheet.set_column(i, i, largura)
+    worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+    for inicio in range(0, len(df), EXCEL_CHUNK_ROWS):
+        bloco = df.iloc[inicio:inicio + EXCEL_CHUNK_ROWS].astype(object)
+        # Células ausentes (NaN, NA) ficam em branco.
+        for linha, valores in enumerate(bloco.where(bloco.notna(), None).to_numpy().tolist(), start=inicio + 1):
+            worksheet.write_row(linha, 0, valores)
+    return worksheet
+
+def to_excel(df):
+    """Planilha .xlsx com `df` na aba 'Relatorio', gravada com o xlsxwriter em modo `constant_memory`.
+
+    Cada linha vai para um arquivo temporário assim que é gravada, então a memória usada não cresce
+    com o tamanho da exportação (só o arquivo final compactado fica em memória).
+    """
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'strings_to_formulas': False, 'strings_to_urls': False})
+    write_sheet(workbook, 'Relatorio', df)
+    workbook.close()
+    return output.getvalue()
+
+def to_csv_bytes(df, compression=None):
+    """CSV em UTF-8, opcionalmente compactado ('gzip' ou 'zstd')."""
+    if compression is None:
+        return df.to_csv(index=False).encode('utf-8')
+    output = BytesIO()
+    df.to_csv(output, index=False, encoding='utf-8', compression={'method': compression})
+    return output.getvalue()
+
+def _mixed_as_text(serie):
+    """Coluna (ou categorias) com tipos misturados, como 4300151 e "MAC0110", convertida para texto; ausentes continuam ausentes.
+
+    O Arrow exige um único tipo por coluna. Categorias que viram o mesmo texto (1 e "1") são unidas.
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        categorias = serie.cat.categories
+        if categorias.dtype != object or pd.api.types.infer_dtype(categorias) == 'string':
+            return serie
+        textos, recodificar = np.unique(categorias.astype(str), return_inverse=True)
+        codigos = serie.cat.codes.to_numpy()
+        codigos = np.where(codigos >= 0, recodificar.ravel()[codigos], -1)
+        return pd.Series(pd.Categorical.from_codes(codigos, textos), index=serie.index, name=serie.name)
+    if serie.dtype == object and pd.api.types.infer_dtype(serie, skipna=True) not in ('string', 'empty'):
+        return serie.map(str, na_action='ignore')
+    return serie
+
+def to_parquet_bytes(df):
+    """Parquet (zstd) com codificação de dicionário nas colunas categóricas, que voltam como categoria ao reler com pandas."""
+    df = df.copy(deep=False)
+    for col in df.columns:
+        df[col] = _mixed_as_text(df[col])
+    categoricas = [col for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)]
+    output = BytesIO()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), output, compression='zstd', use_dictionary=categoricas or False)
+    return output.getvalue()
+
+def dossier_file_name(nusp, nome):
+    """Nome do arquivo do dossiê: NUSP e nome sem acentos, só com letras, dígitos e '_'."""
+    texto = unicodedata.normalize("NFKD", str(nome)).encode("ascii", "ignore").decode("ascii")
+    return f"{nusp}_{'_'.join(re.findall(r'[A-Za-z0-9]+', texto))[:60]}.xlsx"
+
+def build_dossiers(lote):
+    """Grava um lote de dossiês, `lote` = [(nusp, nome, {aba: DataFrame}), ...]: uma planilha por aluno, uma aba por tabela.
+
+    Retorna [(nome do arquivo, bytes), ...] na mesma ordem.
+    """
+    arquivos = []
+    for nusp, nome, tabelas in lote:
+        output = BytesIO()
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'strings_to_formulas': False, 'strings_to_urls': False})
+        for aba, df in tabelas.items():
+            write_sheet(workbook, aba, df)
+        workbook.close()
+        arquivos.append((dossier_file_name(nusp, nome), output.getvalue()))
+    return arquivos
@@ -0,0 +1,195 @@
+"""Leitura dos arquivos enviados: detecção de formato, cabeçalho e conteúdo."""
+import csv
+from datetime import date, datetime
+from functools import partial
+from io import BytesIO
+from operator import itemgetter
+
+import openpyxl
+import pandas as pd
+
+try:
+    import python_calamine  # leitor opcional, bem mais rápido que o openpyxl
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
+
+XLSX_MAGIC = b"PK\x03\x04"  # .xlsx é um arquivo zip
+XLS_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"  # .xls legado (OLE2)
+CSV_DELIMITERS = ";,\t|"
+SNIFF_SAMPLE_BYTES = 64 * 1024
+# Linhas por bloco na leitura em streaming do .xlsx (limita a memória de objetos Python intermediários).
+STREAM_CHUNK_ROWS = 20_000
+
+def detect_format(data, file_name):
+    """Identifica o formato pelo cabeçalho binário (e extensão) e, para texto, o separador e a codificação."""
+    extension = file_name.rsplit(".", 1)[-1].lower() if "." in file_name else ""
+    if data.startswith(XLSX_MAGIC):
+        return {"formato": "xlsx"}
+    if data.startswith(XLS_MAGIC):
+        return {"formato": "xls"}
+    if extension in ("xlsx", "xls"):
+        raise ValueError(f"O arquivo '{file_name}' tem extensão .{extension}, mas o conteúdo não é de uma planilha Excel.")
+
+    sample = data[:SNIFF_SAMPLE_BYTES]
+    if sample.startswith(b"\xef\xbb\xbf"):
+        encoding = "utf-8-sig"
+    else:
+        # Confere o arquivo inteiro, não só a amostra: num export latin-1 o primeiro acento pode
+        # aparecer só nas últimas linhas (ex.: "Não aprovado").
+        try:
+            data.decode("utf-8")
+            encoding = "utf-8"
+        except UnicodeDecodeError:
+            encoding = "latin-1"
+    text = sample.decode(encoding, errors="ignore")
+    try:
+        sep = csv.Sniffer().sniff(text, delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        # Sem padrão claro: usa o separador mais frequente na linha de cabeçalho.
+        header = text.splitlines()[0] if text else ""
+        sep = max(CSV_DELIMITERS, key=header.count) if any(d in header for d in CSV_DELIMITERS) else ","
+    return {"formato": "csv", "sep": sep, "encoding": encoding}
+
+def xlsx_engine():
+    """Leitor usado para .xlsx: calamine quando instalado, senão openpyxl em modo somente leitura."""
+    return "calamine (streaming)" if HAS_CALAMINE else "openpyxl (streaming)"
+
+def _open_sheet(data, sheet_name):
+    workbook = openpyxl.load_workbook(BytesIO(data), read_only=True, data_only=True)
+    sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+    return workbook, sheet
+
+def _header_names(values):
+    """Nomes de coluna no mesmo padrão do pandas: 'Unnamed: i' para vazios e sufixo '.n' para repetidos."""
+    names, seen = [], {}
+    for i, value in enumerate(values):
+        name = f"Unnamed: {i}" if value is None else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def _frame_from_rows(rows, columns, offsets, width, total, progress=None, convert=None):
+    """Monta o DataFrame em blocos de STREAM_CHUNK_ROWS a partir das linhas devolvidas pelo leitor.
+
+    `offsets` são as posições das colunas usadas em cada linha; linhas mais curtas que `width` são
+    completadas com None e `convert`, se informado, é aplicado a cada valor usado. `progress`, se
+    informado, é chamado a cada bloco com (linhas lidas, total estimado de linhas).
+    """
+    pick = itemgetter(*offsets) if len(offsets) > 1 else (lambda row: (row[offsets[0]],))
+    chunks, chunk, lidas = [], [], 0
+    for row in rows:
+        if len(row) < width:
+            row = tuple(row) + (None,) * (width - len(row))
+        values = pick(row)
+        if convert:
+            values = tuple(map(convert, values))
+        # Linhas totalmente vazias (comuns no fim de planilhas editadas) são descartadas.
+        if all(v is None for v in values):
+            continue
+        chunk.append(values)
+        if len(chunk) >= STREAM_CHUNK_ROWS:
+            chunks.append(pd.DataFrame.from_records(chunk, columns=columns))
+            lidas += len(chunk)
+            chunk = []
+            if progress:
+                progress(lidas, max(total, lidas))
+    if chunk or not chunks:
+        chunks.append(pd.DataFrame.from_records(chunk, columns=columns))
+        lidas += len(chunk)
+    if progress:
+        progress(lidas, lidas)
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+def _read_xlsx_streaming(data, usecols=None, sheet_name=0, progress=None):
+    """Lê a aba linha a linha com o openpyxl (read_only) e monta o DataFrame em blocos."""
+    workbook, sheet = _open_sheet(data, sheet_name)
+    try:
+        header = _header_names(next(sheet.iter_rows(max_row=1, values_only=True), ()))
+        positions = list(range(len(header))) if usecols is None else list(usecols)
+        # Só o intervalo entre a primeira e a última coluna usada é montado (min_col/max_col começam em 1).
+        first = min(positions, default=0)
+        width = max(positions, default=-1) - first + 1
+        rows = sheet.iter_rows(min_row=2, min_col=first + 1, max_col=first + width if width else None, values_only=True)
+        total = max((sheet.max_row or 0) - 1, 0)
+        return _frame_from_rows(rows, [header[i] for i in positions], [i - first for i in positions], width, total, progress)
+    finally:
+        workbook.close()
+
+def _calamine_value(value):
+    """Valor do calamine no formato do openpyxl/pandas: célula vazia é None, número inteiro é int e data é datetime."""
+    if value == "":
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if type(value) is date:
+        return datetime(value.year, value.month, value.day)
+    return value
+
+def _read_xlsx_calamine(data, usecols=None, sheet_name=0, progress=None):
+    """Lê a aba linha a linha com o calamine e monta o DataFrame em blocos."""
+    workbook = python_calamine.CalamineWorkbook.from_filelike(BytesIO(data))
+    try:
+        sheet = workbook.get_sheet_by_index(sheet_name) if isinstance(sheet_name, int) else workbook.get_sheet_by_name(sheet_name)
+        rows = iter(sheet.iter_rows())
+        # O calamine começa na primeira coluna com dados; completa à esquerda para manter as posições do cabeçalho.
+        lead = sheet.start[1] if sheet.start else 0
+        if lead:
+            rows = ([""] * lead + row for row in rows)
+        header = _header_names([_calamine_value(v) for v in next(rows, [])])
+        positions = list(range(len(header))) if usecols is None else list(usecols)
+        total = max(sheet.height - 1, 0)
+        return _frame_from_rows(rows, [header[i] for i in positions], positions, max(positions, default=-1) + 1, total, progress, _calamine_value)
+    finally:
+        workbook.close()
+
+def list_sheets(data, info):
+    """Abas da planilha (ou [0] para CSV, que tem uma única tabela)."""
+    if info["formato"] == "xlsx":
+        workbook = openpyxl.load_workbook(BytesIO(data), read_only=True)
+        try:
+            return workbook.sheetnames
+        finally:
+            workbook.close()
+    if info["formato"] == "xls":
+        return pd.ExcelFile(BytesIO(data)).sheet_names
+    return [0]
+
+def read_header(data, info, sheet_name=0):
+    """Lê apenas a linha de cabeçalho do arquivo (ou da aba)."""
+    if info["formato"] == "csv":
+        return pd.read_csv(BytesIO(data), sep=info["sep"], encoding=info["encoding"], nrows=0).columns.tolist()
+    if info["formato"] == "xlsx":
+        workbook, sheet = _open_sheet(data, sheet_name)
+        try:
+            return _header_names(next(sheet.iter_rows(max_row=1, values_only=True), ()))
+        finally:
+            workbook.close()
+    return pd.read_excel(BytesIO(data), sheet_name=sheet_name, nrows=0).columns.tolist()
+
+def parse_file(data, info, usecols=None, sheet_name=0, progress=None):
+    """Lê o conteúdo com o leitor correspondente ao formato detectado, opcionalmente só algumas colunas."""
+    if info["formato"] == "csv":
+        return pd.read_csv(BytesIO(data), sep=info["sep"], encoding=info["encoding"], usecols=usecols)
+    if info["formato"] == "xlsx":
+        reader = _read_xlsx_calamine if HAS_CALAMINE else _read_xlsx_streaming
+        return reader(data, usecols, sheet_name, progress)
+    return pd.read_excel(BytesIO(data), sheet_name=sheet_name, usecols=usecols)
+
+def parse_sheets(args, progress=None):
+    """Lê as abas planejadas de um arquivo, `args` = (data, [(info, usecols, sheet_name), ...]).
+
+    Retorna, na mesma ordem, o DataFrame ou a exceção de cada aba. `progress`, se informado, recebe (info, linhas lidas, total).
+    """
+    data, partes = args
+    resultados = []
+    for info, usecols, sheet_name in partes:
+        try:
+            resultados.append(parse_file(data, info, usecols, sheet_name, progress=progress and partial(progress, info)))
+        except Exception as e:
+            resultados.append(e)
+    return resultados
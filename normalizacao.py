@@ -0,0 +1,50 @@
+"""Normalização do Número USP (NUSP) das tabelas carregadas."""
+import numpy as np
+import pandas as pd
+
+# Faixa de dígitos aceita para um Número USP.
+NUSP_MIN_DIGITS = 4
+NUSP_MAX_DIGITS = 9
+
+def normalize_nusp(df):
+    """Normaliza a coluna 'nusp' numa única passada vetorizada.
+
+    Aceita números (1234567 ou 1234567.0) e textos como "12.345.678", "123.456", "NUSP 1234567" ou
+    com espaços sobrando. Células numéricas negativas ou não inteiras (1234.5) são rejeitadas; só
+    células de texto passam pela recuperação, onde "." e "-" entre dígitos são separadores de milhar.
+    Retorna (linhas válidas com NUSP inteiro, linhas rejeitadas com a coluna 'motivo', quantidade de
+    NUSPs recuperados de texto).
+    """
+    original = df["nusp"]
+    # Só células que já são números entram no ramo numérico: o texto "123.456" é um NUSP com separador, não 123,456.
+    if original.dtype == object:
+        eh_texto = original.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+    else:
+        eh_texto = np.zeros(len(original), dtype=bool)
+    numero = pd.to_numeric(original.where(~eh_texto), errors="coerce")
+    numerico = numero.notna().to_numpy()
+    inteiro = numerico & ((numero % 1 == 0) & (numero >= 0)).to_numpy()
+    # Tira o ".0" de números gravados como texto ("1234567.0") e os separadores entre dígitos ("12.345.678").
+    texto = original.astype(str).str.strip().str.replace(r"(?<=\d)\.0$", "", regex=True).str.replace(r"(?<=\d)[.-](?=\d)", "", regex=True)
+    grupos = texto.str.count(r"\d+")
+    candidato = texto.str.extract(r"(\d+)", expand=False)
+    candidato[inteiro] = numero[inteiro].astype("int64").astype(str)
+    n_digitos = candidato.str.len()
+
+    motivo = pd.Series(np.select(
+        [original.isna().to_numpy() | (texto == "").to_numpy(),
+         numerico & ~inteiro,
+         ~numerico & (grupos == 0).to_numpy(),
+         ~numerico & (grupos > 1).to_numpy(),
+         ~n_digitos.between(NUSP_MIN_DIGITS, NUSP_MAX_DIGITS).to_numpy()],
+        ["NUSP vazio", "valor numérico negativo ou não inteiro", "sem dígitos", "mais de um número no campo",
+         f"comprimento fora de {NUSP_MIN_DIGITS} a {NUSP_MAX_DIGITS} dígitos"],
+        default=""), index=df.index)
+    rejeitado = (motivo != "").to_numpy()
+    # Texto que já era só o número ("1234567", " 1234567 ") não conta como recuperado.
+    so_digitos = original.astype(str).str.fullmatch(r"\s*\d+\s*").to_numpy(dtype=bool)
+
+    rejeitados = df[rejeitado].assign(motivo=motivo[rejeitado])
+    validos = df[~rejeitado].copy()
+    validos["nusp"] = candidato[~rejeitado].astype("int64")
+    return validos, rejeitados, int((eh_texto & ~so_digitos & ~rejeitado).sum())
@@ -0,0 +1,67 @@
+"""Classificação dos pareceres em status a partir do léxico configurável (lexico_pareceres.json)."""
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+# Status do parecer, calculado uma única vez após a leitura e reutilizado por métricas, detalhes e exportação.
+STATUS_CATEGORIES = ['aprovado', 'negado', 'pendente', 'outro']
+
+
+class LexiconError(Exception):
+    """Arquivo de léxico de pareceres inválido (JSON malformado, status desconhecido ou padrão com erro)."""
+
+
+def fold_text(textos):
+    """Texto em minúsculas, sem acentos (NFKD), com pontuação e espaços repetidos reduzidos a um espaço.
+
+    Assim "Não-aprovado", "não  aprovado" e "NÃO APROVADO" ficam iguais a "nao aprovado".
+    """
+    ascii_ = textos.str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii').str.lower()
+    return ascii_.str.replace(r"[^a-z0-9]+", " ", regex=True).str.strip()
+
+
+def classify_texts(textos, lexico):
+    """Status de cada texto (não nulo) numa única varredura da regex combinada do léxico."""
+    dobrados = fold_text(pd.Series(textos, dtype=object))
+    casou = dobrados.str.extract(lexico["padrao"]).notna().to_numpy()
+    # Sem regra casada, o índice aponta para o último status ("outro").
+    regra = np.where(casou.any(axis=1), casou.argmax(axis=1), len(lexico["status"]) - 1)
+    status = lexico["status"][regra]
+    status[(dobrados == '').to_numpy()] = 'pendente'
+    return status
+
+
+def compile_lexicon(conteudo):
+    """Compila as regras do léxico numa única regex.
+
+    Cada regra vira uma alternativa ancorada no início do texto, `(?=.*\\b(?:padrões)\\b)(?P<rN>)`:
+    a primeira que casar define o status, respeitando a ordem do arquivo mesmo quando o termo de
+    uma regra posterior aparece antes no texto ("não aprovado"). Os padrões são comparados com o
+    texto de `fold_text`. Levanta LexiconError se o arquivo for inválido.
+    """
+    try:
+        regras = json.loads(conteudo)["regras"]
+        invalidos = [r["status"] for r in regras if r["status"] not in STATUS_CATEGORIES]
+        if invalidos:
+            raise LexiconError(f"status desconhecido(s) {', '.join(invalidos)}. Use {', '.join(STATUS_CATEGORIES)}.")
+        padrao = "(?s)^(?:" + "|".join(f"(?=.*?\\b(?:{'|'.join(r['padroes'])})\\b)(?P<r{i}>)" for i, r in enumerate(regras)) + ")"
+        re.compile(padrao)
+    except (ValueError, KeyError, TypeError, re.error) as e:
+        raise LexiconError(f"Léxico de pareceres inválido: {e}") from e
+    return {"padrao": padrao, "status": np.array([r["status"] for r in regras] + ["outro"], dtype=object), "regras": len(regras)}
+
+
+def classify_parecer(pareceres, lexico):
+    """Classifica os pareceres em status (coluna categórica) numa passada vetorizada.
+
+    Só os valores distintos (categorias) passam pela regex do léxico e o resultado é expandido
+    pelos códigos; parecer ausente é pendente.
+    """
+    if not isinstance(pareceres.dtype, pd.CategoricalDtype):
+        pareceres = pareceres.astype('category')
+    # O último item atende o código -1 (parecer ausente).
+    status_por_codigo = np.append(classify_texts(pareceres.cat.categories.astype(str), lexico), 'pendente')
+    status = status_por_codigo[pareceres.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical(status, categories=STATUS_CATEGORIES), index=pareceres.index)
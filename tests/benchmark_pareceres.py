@@ -0,0 +1,63 @@
+"""Benchmark da classificação dos pareceres: uma varredura vetorizada contra o laço linha a linha.
+
+Uso: python tests/benchmark_pareceres.py [linhas]
+"""
+import os
+import re
+import sys
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pareceres import classify_parecer, compile_lexicon  # noqa: E402
+from test_pareceres import EXEMPLOS, LEXICON_PATH  # noqa: E402
+
+
+def classify_loop(pareceres, lexico):
+    """Referência: cada linha dobrada e comparada com a regex separadamente."""
+    padrao = re.compile(lexico["padrao"])
+    status = []
+    for parecer in pareceres:
+        if pd.isna(parecer):
+            status.append("pendente")
+            continue
+        texto = unicodedata.normalize("NFKD", str(parecer)).encode("ascii", "ignore").decode("ascii").lower()
+        texto = re.sub(r"[^a-z0-9]+", " ", texto).strip()
+        casou = padrao.match(texto)
+        if not texto:
+            status.append("pendente")
+        elif casou is None:
+            status.append("outro")
+        else:
+            status.append(lexico["status"][int(casou.lastgroup[1:])])
+    return status
+
+
+def main(linhas):
+    with open(LEXICON_PATH, encoding="utf-8") as f:
+        lexico = compile_lexicon(f.read())
+    rng = np.random.default_rng(0)
+    # Como nos arquivos reais: poucos textos distintos repetidos em muitas linhas.
+    textos = [parecer for parecer, _ in EXEMPLOS] + [f"Deferido - turma {i:02d}" for i in range(200)]
+    pareceres = pd.Series(rng.choice(np.array(textos, dtype=object), linhas)).astype("category")
+
+    inicio = time.perf_counter()
+    vetorizado = classify_parecer(pareceres, lexico)
+    tempo_vetorizado = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    laco = classify_loop(pareceres, lexico)
+    tempo_laco = time.perf_counter() - inicio
+
+    assert vetorizado.astype(str).tolist() == laco
+    print(f"{linhas:,} pareceres ({len(textos)} distintos)")
+    print(f"classify_parecer: {tempo_vetorizado * 1000:.1f} ms")
+    print(f"laço por linha:   {tempo_laco * 1000:.1f} ms ({tempo_laco / tempo_vetorizado:.0f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
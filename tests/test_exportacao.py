@@ -0,0 +1,27 @@
+from io import BytesIO
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from exportacao import to_parquet_bytes
+
+
+def test_parquet_com_tipos_misturados():
+    # Como o apply_schema deixa o histórico quando Semestre ou disciplina misturam números e texto.
+    df = pd.DataFrame({
+        "nusp": pd.array([1234567, 7654321, 1111111], dtype="uint32"),
+        "disciplina_historico": pd.Series([4300151, "MAC0110", None], dtype="category"),
+        "Semestre_historico": pd.Series(["1º", 1, 2], dtype="category"),
+        "Nome completo": ["Ana", 42, None],
+        "problema_atual": pd.Series(["QR", "CH", "QR"], dtype="category"),
+    })
+
+    relido = pq.read_table(BytesIO(to_parquet_bytes(df))).to_pandas()
+
+    assert relido["disciplina_historico"].astype(object).tolist()[:2] == ["4300151", "MAC0110"]
+    assert pd.isna(relido["disciplina_historico"].iloc[2])
+    assert relido["Semestre_historico"].astype(str).tolist() == ["1º", "1", "2"]
+    assert isinstance(relido["Semestre_historico"].dtype, pd.CategoricalDtype)
+    assert relido["Nome completo"].tolist()[:2] == ["Ana", "42"]
+    assert relido["problema_atual"].tolist() == ["QR", "CH", "QR"]
+    assert relido["nusp"].tolist() == [1234567, 7654321, 1111111]
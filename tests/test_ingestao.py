@@ -0,0 +1,62 @@
+from io import BytesIO
+
+import pandas as pd
+import pytest
+
+import ingestao
+from ingestao import _read_xlsx_calamine, _read_xlsx_streaming, detect_format, parse_file
+
+LEITORES_XLSX = [
+    _read_xlsx_streaming,
+    pytest.param(_read_xlsx_calamine, marks=pytest.mark.skipif(not ingestao.HAS_CALAMINE, reason="python-calamine não instalado")),
+]
+
+
+def test_csv_latin1_com_acento_apenas_no_fim():
+    # O acento só aparece depois da amostra usada para detectar o separador.
+    linhas = ["nusp;disciplina;parecer"] + [f"{1000000 + i};MAC0110;Aprovado" for i in range(3000)]
+    linhas.append("1234567;MAC0110;Não aprovado")
+    data = "\n".join(linhas).encode("latin-1")
+
+    info = detect_format(data, "consolidado.csv")
+
+    assert info == {"formato": "csv", "sep": ";", "encoding": "latin-1"}
+    df = parse_file(data, info)
+    assert df["parecer"].iloc[-1] == "Não aprovado"
+
+
+def test_csv_utf8():
+    data = "nusp,parecer\n1234567,Não aprovado\n".encode("utf-8")
+
+    assert detect_format(data, "requerimentos.csv") == {"formato": "csv", "sep": ",", "encoding": "utf-8"}
+
+
+@pytest.mark.parametrize("leitor", LEITORES_XLSX)
+def test_xlsx_le_so_as_colunas_pedidas(leitor):
+    df = pd.DataFrame({
+        "observacao": ["a", "b", None],
+        "nusp": [1234567, 7654321, 1111111],
+        "extra": [1, 2, 3],
+        "parecer": ["Aprovado", None, "Negado"],
+        "fim": ["x", "y", "z"],
+    })
+    output = BytesIO()
+    df.to_excel(output, index=False)
+
+    lido = leitor(output.getvalue(), usecols=[1, 3])
+
+    pd.testing.assert_frame_equal(lido, df[["nusp", "parecer"]])
+
+
+@pytest.mark.parametrize("leitor", LEITORES_XLSX)
+def test_xlsx_informa_progresso_por_bloco(leitor, monkeypatch):
+    monkeypatch.setattr(ingestao, "STREAM_CHUNK_ROWS", 10)
+    df = pd.DataFrame({"nusp": range(1000000, 1000025), "Ano": [2024] * 25})
+    output = BytesIO()
+    df.to_excel(output, index=False)
+    chamadas = []
+
+    lido = leitor(output.getvalue(), progress=lambda lidas, total: chamadas.append((lidas, total)))
+
+    pd.testing.assert_frame_equal(lido, df)
+    assert chamadas == [(10, 25), (20, 25), (25, 25)]
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from normalizacao import normalize_nusp
+
+
+@pytest.mark.parametrize("valor, nusp", [
+    (1234567, 1234567),
+    (1234567.0, 1234567),
+    ("1234567", 1234567),
+    (" 1234567 ", 1234567),
+    ("1234567.0", 1234567),
+    ("12.345.678", 12345678),
+    ("123.456", 123456),
+    ("1.234", 1234),
+    ("12-345-678", 12345678),
+    ("NUSP 1234567", 1234567),
+])
+def test_nusp_aceito(valor, nusp):
+    validos, rejeitados, _ = normalize_nusp(pd.DataFrame({"nusp": [valor]}))
+
+    assert rejeitados.empty
+    assert validos["nusp"].tolist() == [nusp]
+
+
+@pytest.mark.parametrize("valor, motivo", [
+    (1234.5, "valor numérico negativo ou não inteiro"),
+    (-1234567, "valor numérico negativo ou não inteiro"),
+    ("12 34", "mais de um número no campo"),
+    ("12 e 34", "mais de um número no campo"),
+    ("abc", "sem dígitos"),
+    ("  ", "NUSP vazio"),
+    (None, "NUSP vazio"),
+    (12, "comprimento fora de 4 a 9 dígitos"),
+    ("1234567890", "comprimento fora de 4 a 9 dígitos"),
+])
+def test_nusp_rejeitado(valor, motivo):
+    validos, rejeitados, _ = normalize_nusp(pd.DataFrame({"nusp": [valor], "disciplina": ["MAC0110"]}))
+
+    assert validos.empty
+    assert rejeitados["motivo"].tolist() == [motivo]
+    assert rejeitados["disciplina"].tolist() == ["MAC0110"]
+
+
+def test_recuperados_conta_so_textos_com_formatacao():
+    df = pd.DataFrame({"nusp": [1234567, "7654321", "12.345.678", "NUSP 1111111", "abc"]})
+
+    validos, rejeitados, recuperados = normalize_nusp(df)
+
+    assert validos["nusp"].tolist() == [1234567, 7654321, 12345678, 1111111]
+    assert len(rejeitados) == 1
+    assert recuperados == 2
+
+
+def test_coluna_numerica():
+    validos, rejeitados, recuperados = normalize_nusp(pd.DataFrame({"nusp": [1234567.0, float("nan"), 7654321.0]}))
+
+    assert validos["nusp"].tolist() == [1234567, 7654321]
+    assert rejeitados["motivo"].tolist() == ["NUSP vazio"]
+    assert recuperados == 0
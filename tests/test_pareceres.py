@@ -0,0 +1,70 @@
+import os
+
+import pandas as pd
+import pytest
+
+from pareceres import STATUS_CATEGORIES, LexiconError, classify_parecer, compile_lexicon
+
+LEXICON_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lexico_pareceres.json")
+
+# Pareceres reais (e variações de digitação) com o status esperado.
+EXEMPLOS = [
+    ("Aprovado", "aprovado"),
+    ("APROVADO", "aprovado"),
+    ("Aprovada pela CoC", "aprovado"),
+    ("Deferido", "aprovado"),
+    ("DEFERIDO", "aprovado"),
+    ("DEFERIDO PARCIALMENTE", "aprovado"),
+    ("Deferido parcialmente - apenas a turma 02", "aprovado"),
+    ("Parcialmente deferido", "aprovado"),
+    ("Parcialmente-deferido", "aprovado"),
+    ("Indeferido", "negado"),
+    ("indeferida", "negado"),
+    ("INDEFERIDO - falta de pré-requisito", "negado"),
+    ("Negado", "negado"),
+    ("Pedido negado por conflito de horário", "negado"),
+    ("não aprovado", "negado"),
+    ("Não aprovada", "negado"),
+    ("Nao deferido", "negado"),
+    ("Não-aprovado", "negado"),
+    ("não  aprovado", "negado"),
+    ("NÃO\tAPROVADO", "negado"),
+    ("Não aprovado.", "negado"),
+    ("Aprovado na 1ª análise, indeferido após recurso", "negado"),
+    ("Em análise", "pendente"),
+    ("Em  análise", "pendente"),
+    ("Aguardando documentação do aluno", "pendente"),
+    ("Pendente", "pendente"),
+    ("   ", "pendente"),
+    ("Cancelado pelo aluno", "outro"),
+    ("Ver observação", "outro"),
+]
+
+
+@pytest.fixture(scope="module")
+def lexico():
+    with open(LEXICON_PATH, encoding="utf-8") as f:
+        return compile_lexicon(f.read())
+
+
+@pytest.mark.parametrize("parecer, esperado", EXEMPLOS)
+def test_exemplos(lexico, parecer, esperado):
+    assert classify_parecer(pd.Series([parecer]), lexico).iloc[0] == esperado
+
+
+def test_parecer_ausente_e_pendente(lexico):
+    status = classify_parecer(pd.Series(["Aprovado", None], dtype="category"), lexico)
+
+    assert status.tolist() == ["aprovado", "pendente"]
+    assert status.cat.categories.tolist() == STATUS_CATEGORIES
+
+
+@pytest.mark.parametrize("conteudo", [
+    "{",
+    '{"regras": [{"status": "talvez", "padroes": ["talvez"]}]}',
+    '{"regras": [{"status": "aprovado", "padroes": ["aprovad[oa"]}]}',
+    '{"regras": [{"status": "aprovado"}]}',
+])
+def test_lexico_invalido(conteudo):
+    with pytest.raises(LexiconError):
+        compile_lexicon(conteudo)